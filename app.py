@@ -7,7 +7,7 @@ from src.ui.dashboard import render_dashboard
 from src.ui.importer import render_importer
 from src.ui.transactions import render_transactions
 from src.ui.analysis import render_analysis
-from src.ui.settings import render_settings
+from src.ui.settings import render_settings, cached_backup_zip
 from src.ui.recurring import render_recurring
 from src.ui.split import render_split
 from src.ui.tag_manager import render_tag_manager
@@ -49,13 +49,21 @@ if st.session_state.get('recurring_autogen_count'):
     st.session_state['recurring_autogen_count'] = 0
 
 # Alert ricorrenti/bollette in arrivo (prossimi 7 giorni)
+@st.cache_data(show_spinner=False, max_entries=4)
+def _upcoming_due(_dm, end_date, db_path, data_version):
+    """(numero, totale) delle spese ricorrenti proiettate fino a `end_date`."""
+    upc = _dm.get_projected_recurring(end_date)
+    if upc is None or upc.empty:
+        return 0, 0.0
+    amounts = upc['amount'].to_numpy()
+    due = amounts[amounts < 0]
+    return len(due), float(-due.sum())
+
 try:
     from datetime import date as _date, timedelta as _td
-    _upc = dm.get_projected_recurring(_date.today() + _td(days=7))
-    if _upc is not None and not _upc.empty:
-        _due = _upc[_upc['amount'] < 0]
-        if not _due.empty:
-            st.sidebar.warning(f"⏰ {len(_due)} spese ricorrenti in arrivo (7gg): €{_due['amount'].abs().sum():,.0f}")
+    _n_due, _tot_due = _upcoming_due(dm, _date.today() + _td(days=7), dm.db_path, dm.data_version)
+    if _n_due:
+        st.sidebar.warning(f"⏰ {_n_due} spese ricorrenti in arrivo (7gg): €{_tot_due:,.0f}")
 except Exception:
     pass
 
@@ -224,7 +232,7 @@ with st.sidebar.expander("💾 Backup & Ripristino", expanded=False):
     if _bks:
         _last = os.path.basename(_bks[0]).replace('finance_backup_', '').replace('.zip', '')
         st.caption(f"🗂️ Backup automatici: {len(_bks)} · ultimo {_last}")
-    zip_data = dm.export_backup_zip()
+    zip_data = cached_backup_zip(dm, dm.db_path, dm.data_version)
     st.download_button(
         label="⬇️ Esporta Backup",
         data=zip_data,
@@ -2,8 +2,43 @@ import duckdb
 import pandas as pd
 import zipfile
 import os
-from .utils import clean_currency, normalize_tags
-from .rules_engine import RulesEngine
+import uuid
+from .utils import clean_currency, normalize_tags, clean_tag
+from .rules_engine import RulesEngine, AUTO_TAG_KEYWORDS
+
+# Versione dei dati per db_path, incrementata a ogni scrittura: fa da chiave per
+# le cache della UI (condivisa tra le sessioni dello stesso processo).
+_DATA_VERSIONS = {}
+
+
+def _sql_lit(v):
+    """Letterale SQL per una stringa delle regole (NULL se mancante)."""
+    if v is None:
+        return "NULL"
+    return "'" + str(v).replace("'", "''") + "'"
+
+
+def _tag_key(t):
+    """Tag di una riga come tupla confrontabile (lista, array DuckDB, None/NaN)."""
+    if t is None:
+        return ()
+    if hasattr(t, 'tolist'):
+        t = t.tolist()
+    if isinstance(t, (list, tuple)):
+        return tuple(t)
+    return () if pd.isna(t) else (t,)
+
+
+def _tag_list(t):
+    """Tag di una cella come lista di str per una colonna VARCHAR[] (None/NaN -> NULL)."""
+    if t is None or (not hasattr(t, '__len__') and pd.isna(t)):
+        return None
+    return [str(x) for x in _tag_key(t)]
+
+
+def _changed(new, old):
+    """Maschera delle celle cambiate (NaN/None su entrambi i lati = invariato)."""
+    return new.ne(old) & ~(new.isna() & old.isna())
 
 class DataManager:
     def __init__(self, db_path=None):
@@ -16,6 +51,15 @@ class DataManager:
         self.rules_engine = RulesEngine()
         self.setup_db()
 
+    @property
+    def data_version(self):
+        """Contatore delle scritture sul DB: cambia ogni volta che i dati cambiano."""
+        return _DATA_VERSIONS.get(self.db_path, 0)
+
+    def bump_data_version(self):
+        """Da chiamare dopo ogni scrittura su transactions/recurring_expenses."""
+        _DATA_VERSIONS[self.db_path] = self.data_version + 1
+
     def auto_backup(self, max_keep=14):
         """
         Crea un backup ZIP giornaliero in <cartella_dati>/backups (uno al giorno),
@@ -88,8 +132,23 @@ class DataManager:
             VALUES (uuid(), ?, ?, 'EUR', ?, 'Trasferimento', [], ?,
                     'Incoming Transfer', 'manual_transfer', ?, 'Need')
         """, [date, amt, to_account, desc, desc])
+        self.bump_data_version()
         return True
 
+    def add_balance_adjustment(self, account, amount, date):
+        """
+        Inserisce una transazione 'Adjustment' per allineare il saldo di un
+        portafoglio a quello reale. L'id è generato in Python.
+        """
+        self.con.execute("""
+            INSERT INTO transactions
+                (id, date, amount, currency, account, category, tags, description,
+                 type, source_file, original_description, necessity)
+            VALUES (?, ?, ?, 'EUR', ?, 'Adjustment', [], 'Manual Balance Reconciliation',
+                    'Adjustment', 'reconcile', 'Balance Fix', 'Need')
+        """, [str(uuid.uuid4()), date, float(amount), account])
+        self.bump_data_version()
+
     def setup_db(self):
         self.con.execute("""
             CREATE TABLE IF NOT EXISTS transactions (
@@ -166,6 +225,7 @@ class DataManager:
             INSERT INTO recurring_expenses (name, amount, category, account, frequency, next_date, description, tags, remaining_installments, end_date)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, [name, amount, category, account, frequency, start_date, description, tags, installments, end_date])
+        self.bump_data_version()
 
     def update_recurring(self, rec_id, **kwargs):
         """
@@ -190,9 +250,12 @@ class DataManager:
         values.append(rec_id)
         q = f"UPDATE recurring_expenses SET {', '.join(set_parts)} WHERE id = ?"
         self.con.execute(q, values)
+        self.bump_data_version()
 
-    def get_recurring(self):
-        return self.con.execute("SELECT * FROM recurring_expenses ORDER BY next_date").df()
+    def get_recurring(self, cols=None):
+        """Ricorrenti ordinate per scadenza; `cols` limita le colonne lette (default tutte)."""
+        select = ", ".join(cols) if cols else "*"
+        return self.con.execute(f"SELECT {select} FROM recurring_expenses ORDER BY next_date").df()
 
     def get_subscription_suggestions(self, min_payments=3):
         """
@@ -230,7 +293,7 @@ class DataManager:
         except Exception:
             ref = df['date'].max()
 
-        rec = self.get_recurring()
+        rec = self.get_recurring(cols=['name'])
         rec_names = ' '.join(rec['name'].astype(str).str.lower().tolist()) if not rec.empty else ''
         ignored = set(str(t).lower() for t in
                       (self.rules_engine.rules.get('ignored_subscription_suggestions', []) or []))
@@ -275,17 +338,66 @@ class DataManager:
         return sorted(suggestions, key=lambda x: x['last'], reverse=True)
 
     def ignore_subscription_suggestion(self, tag):
-        """Marca un tag come 'da non suggerire più' (persistito in rules.yaml)."""
+        """
+        Marca uno o più tag come 'da non suggerire più' (persistito in rules.yaml).
+        `tag` può essere una stringa o una lista: rules.yaml viene salvato una volta sola.
+        """
+        tags = [tag] if isinstance(tag, str) else list(tag)
         rules = self.rules_engine.rules
         lst = rules.get('ignored_subscription_suggestions', []) or []
-        if tag not in lst:
-            lst.append(tag)
+        for t in tags:
+            if t not in lst:
+                lst.append(t)
         rules['ignored_subscription_suggestions'] = lst
         self.rules_engine.save_rules(rules)
         return True
 
     def delete_recurring(self, rec_id):
         self.con.execute("DELETE FROM recurring_expenses WHERE id = ?", [rec_id])
+        self.bump_data_version()
+
+    def bulk_upsert_recurring(self, to_add=(), to_update=(), to_delete=()):
+        """
+        Applica in un'unica transazione le modifiche dell'editor delle ricorrenti.
+        to_add: lista di dict con le colonne di recurring_expenses (senza id)
+        to_update: lista di (rec_id, {colonna: valore})
+        to_delete: lista di id
+        Returns: numero di righe toccate
+        """
+        cols = ['name', 'amount', 'category', 'account', 'frequency', 'next_date',
+                'description', 'tags', 'remaining_installments', 'end_date']
+        to_add, to_update, to_delete = list(to_add), list(to_update), list(to_delete)
+        if not (to_add or to_update or to_delete):
+            return 0
+
+        def _val(v):
+            # NaN/NaT dell'editor -> NULL (le liste dei tag passano invariate)
+            if isinstance(v, (list, tuple)) or getattr(v, 'ndim', 0) > 0:
+                return v
+            return None if pd.isna(v) else v
+
+        self.con.execute("BEGIN TRANSACTION")
+        try:
+            if to_delete:
+                # Un solo DELETE ... IN (...) per tutte le righe rimosse
+                self.con.execute("DELETE FROM recurring_expenses WHERE id IN (SELECT unnest(?::VARCHAR[]))",
+                                 [list(to_delete)])
+            for rec_id, updates in to_update:
+                updates = {k: _val(v) for k, v in updates.items() if k in cols}
+                if updates:
+                    set_sql = ", ".join(f"{k} = ?" for k in updates)
+                    self.con.execute(f"UPDATE recurring_expenses SET {set_sql} WHERE id = ?",
+                                     list(updates.values()) + [rec_id])
+            if to_add:
+                self.con.executemany(
+                    f"INSERT INTO recurring_expenses ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                    [[_val(row.get(c)) for c in cols] for row in to_add])
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        self.bump_data_version()
+        return len(to_add) + len(to_update) + len(to_delete)
 
     def process_recurring(self):
         """Checks for due expenses, inserts them, and updates next_date."""
@@ -295,7 +407,8 @@ class DataManager:
         today = datetime.date.today()
         due = self.con.execute("SELECT * FROM recurring_expenses WHERE next_date <= ?", [today]).df()
         
-        count = 0
+        # Parametri raccolti nel ciclo, poi una sola istruzione (stesso SQL) per tipo
+        tx_params, next_params, inst_params, finished = [], [], [], []
         for _, row in due.iterrows():
             # Get props, handle missing
             desc = row.get('description') if pd.notna(row.get('description')) else row['name']
@@ -316,10 +429,7 @@ class DataManager:
                 current_tags.append('Recurring')
             
             # Insert Transaction
-            self.con.execute("""
-                INSERT INTO transactions (date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity, id)
-                VALUES (?, ?, 'EUR', ?, ?, ?, ?, 'Expense', 'Recurring', ?, 'Need', uuid())
-            """, [row['next_date'], row['amount'], row['account'], row['category'], current_tags, desc, row['name']])
+            tx_params.append([row['next_date'], row['amount'], row['account'], row['category'], current_tags, desc, row['name']])
             
             # Update next_date
             next_date = pd.to_datetime(row['next_date']).date()
@@ -330,24 +440,42 @@ class DataManager:
             elif row['frequency'] == 'Weekly':
                 next_date += datetime.timedelta(weeks=1)
             
-            self.con.execute("UPDATE recurring_expenses SET next_date = ? WHERE id = ?", [next_date, row['id']])
+            next_params.append([next_date, row['id']])
             
             # Handle Installments decrement
             if pd.notna(row['remaining_installments']):
                  new_installments = int(row['remaining_installments']) - 1
                  if new_installments <= 0:
-                     self.delete_recurring(row['id']) # Finished
+                     finished.append(row['id']) # Finished
                  else:
-                     self.con.execute("UPDATE recurring_expenses SET remaining_installments = ? WHERE id = ?", [new_installments, row['id']])
+                     inst_params.append([new_installments, row['id']])
             
             # Handle End Date (if next_date is now beyond end_date, delete)
             if pd.notna(row['end_date']):
                 e_date = pd.to_datetime(row['end_date']).date()
                 if next_date > e_date:
-                    self.delete_recurring(row['id'])
+                    finished.append(row['id'])
 
-            count += 1
-            
+        count = len(tx_params)
+        if count:
+            self.con.execute("BEGIN TRANSACTION")
+            try:
+                self.con.executemany("""
+                    INSERT INTO transactions (date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity, id)
+                    VALUES (?, ?, 'EUR', ?, ?, ?::VARCHAR[], ?, 'Expense', 'Recurring', ?, 'Need', uuid())
+                """, tx_params)
+                self.con.executemany("UPDATE recurring_expenses SET next_date = ? WHERE id = ?", next_params)
+                if inst_params:
+                    self.con.executemany("UPDATE recurring_expenses SET remaining_installments = ? WHERE id = ?", inst_params)
+                if finished:
+                    self.con.execute("DELETE FROM recurring_expenses WHERE id IN (SELECT unnest(?::VARCHAR[]))", [finished])
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+
+        if count:
+            self.bump_data_version()
         return count
 
     def get_initial_balance(self):
@@ -395,7 +523,8 @@ class DataManager:
                 INSERT INTO transactions (id, date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity)
                 VALUES (uuid(), ?, ?, 'EUR', 'Initial Assets', 'Initial Balance', ['Initial'], 'Saldo Iniziale', 'Income', 'manual_entry', 'Saldo Iniziale', 'Need')
             """, [date, amount])
-            
+
+        self.bump_data_version()
         return True
 
     def get_projected_recurring(self, end_date):
@@ -411,10 +540,11 @@ class DataManager:
         if isinstance(end_date, datetime.datetime):
             end_date = end_date.date()
             
-        active_rules = self.get_recurring()
+        active_rules = self.get_recurring(cols=['name', 'amount', 'category', 'account', 'frequency',
+                                                'next_date', 'remaining_installments', 'end_date'])
         projections = []
         
-        for _, rule in active_rules.iterrows():
+        for rule in active_rules.to_dict('records'):
             current_next = pd.to_datetime(rule['next_date']).date()
             
             # Limits
@@ -518,6 +648,14 @@ class DataManager:
         except Exception as e:
             return False, str(e)
 
+    def ingest_zip_bytes(self, buf, respect_existing_category=True):
+        """
+        Come ingest_zip, ma da un file-like già in memoria (es. l'UploadedFile di
+        Streamlit): zipfile legge direttamente dal buffer, niente file su disco.
+        """
+        buf.seek(0)
+        return self.ingest_zip(buf, respect_existing_category=respect_existing_category)
+
     def _process_and_insert(self, df, filename, respect_existing_category=True):
         # Normalize columns based on known schema
         # Schema: Date, Wallet, Type, Category name, Amount, Currency, Note, Labels, Author
@@ -593,6 +731,7 @@ class DataManager:
         # We need to list columns explicitly to match.
         
         self.con.execute("INSERT INTO transactions (date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity, id) SELECT date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity, uuid() FROM df")
+        self.bump_data_version()
 
     def get_tag_category_inconsistencies(self):
         """
@@ -647,6 +786,7 @@ class DataManager:
             f"UPDATE transactions SET necessity = ? WHERE {where}",
             [nec] + where_params
         )
+        self.bump_data_version()
         return cnt
 
     def get_potential_duplicates(self):
@@ -680,15 +820,134 @@ class DataManager:
         ids = [i for i in (ids or []) if i]
         if not ids:
             return 0
-        placeholders = ','.join(['?'] * len(ids))
-        self.con.execute(
-            f"DELETE FROM transactions WHERE id IN ({placeholders})", ids
-        )
+        # Un solo parametro VARCHAR[]: stessa istruzione per qualsiasi numero di id
+        self.con.execute("DELETE FROM transactions WHERE id IN (SELECT unnest(?::VARCHAR[]))", [ids])
+        self.bump_data_version()
         return len(ids)
 
     def get_transactions(self):
         return self.con.execute("SELECT * FROM transactions ORDER BY date DESC").df()
 
+    def get_transaction_filter_options(self):
+        """
+        Valori per i filtri della pagina Transactions, calcolati in DuckDB senza
+        caricare la tabella: dict con total, categories, tags, min_date, max_date
+        e max_abs_amount. Categorie e tag già ordinati, come tuple immutabili.
+        """
+        total, min_date, max_date, max_abs = self.con.execute(
+            "SELECT COUNT(*), min(date), max(date), max(abs(amount)) FROM transactions").fetchone()
+        categories = tuple(r[0] for r in self.con.execute(
+            "SELECT DISTINCT category FROM transactions WHERE category IS NOT NULL ORDER BY 1").fetchall())
+        tags = tuple(r[0] for r in self.con.execute("""
+            SELECT DISTINCT tag FROM (SELECT unnest(tags) AS tag FROM transactions)
+            WHERE tag IS NOT NULL ORDER BY 1
+        """).fetchall())
+        return {'total': total, 'categories': categories, 'tags': tags,
+                'min_date': min_date, 'max_date': max_date, 'max_abs_amount': max_abs}
+
+    @staticmethod
+    def _transaction_filters(search=None, categories=(), tags=(), tx_type=None,
+                             date_range=None, amount_range=None):
+        """Clausola WHERE parametrizzata (e parametri) per i filtri della pagina Transactions."""
+        where, params = ["TRUE"], []
+        if search:
+            # Ricerca testuale letterale, senza distinzione maiuscole/minuscole
+            esc = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("description ILIKE ? ESCAPE '\\'")
+            params.append(f"%{esc}%")
+        if categories:
+            where.append("category = ANY(?::VARCHAR[])")
+            params.append(list(categories))
+        if tags:
+            where.append("list_has_any(tags, ?::VARCHAR[])")
+            params.append(list(tags))
+        if tx_type:
+            where.append("type = ?")
+            params.append(tx_type)
+        if date_range:
+            where.append("date BETWEEN ? AND ?")
+            params.extend(date_range)
+        if amount_range:
+            where.append("abs(amount) BETWEEN ? AND ?")
+            params.extend(float(a) for a in amount_range)
+        return " AND ".join(where), params
+
+    def count_transactions(self, **filters):
+        """Numero di transazioni che passano i filtri (vedi _transaction_filters)."""
+        where, params = self._transaction_filters(**filters)
+        return self.con.execute(f"SELECT COUNT(*) FROM transactions WHERE {where}", params).fetchone()[0]
+
+    def get_transactions_filtered(self, limit=None, offset=0, **filters):
+        """
+        Transazioni filtrate in DuckDB (dalla più recente), opzionalmente una
+        pagina alla volta con `limit`/`offset`.
+        """
+        where, params = self._transaction_filters(**filters)
+        sql = f"SELECT * FROM transactions WHERE {where} ORDER BY date DESC, id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        return self.con.execute(sql, params).df()
+
+    def bulk_save_transactions(self, new_rows=None, changed_rows=None, deleted_ids=()):
+        """
+        Applica in un'unica transazione le modifiche dell'editor delle transazioni:
+        un DELETE per le righe rimosse, un INSERT ... SELECT per le nuove e un
+        UPDATE ... FROM per le modificate (DataFrame con le colonne della tabella;
+        le modificate con `id`). Segni corretti in blocco: Expense < 0, Income > 0.
+        Returns: (aggiunte, modificate, eliminate)
+        """
+        def _signed(df):
+            df = df.copy()
+            amt = pd.to_numeric(df['amount'], errors='coerce')
+            flip = ((df['type'] == 'Expense') & (amt > 0)) | ((df['type'] == 'Income') & (amt < 0))
+            df['amount'] = amt.mask(flip, -amt)
+            return df
+
+        deleted_ids = list(deleted_ids)
+        new_rows = _signed(new_rows) if new_rows is not None and not new_rows.empty else None
+        changed_rows = _signed(changed_rows) if changed_rows is not None and not changed_rows.empty else None
+        if not deleted_ids and new_rows is None and changed_rows is None:
+            return 0, 0, 0
+
+        self.con.execute("BEGIN TRANSACTION")
+        try:
+            if deleted_ids:
+                self.con.execute("DELETE FROM transactions WHERE id IN (SELECT unnest(?::VARCHAR[]))", [deleted_ids])
+            if new_rows is not None:
+                self.con.register('tx_new_rows', new_rows[[
+                    'date', 'amount', 'currency', 'account', 'category', 'description', 'type', 'necessity', 'notes']])
+                self.con.execute("""
+                    INSERT INTO transactions (id, date, amount, currency, account, category, description, type, necessity, notes)
+                    SELECT uuid(), CAST(date AS DATE), amount, currency, account, category, description, type, necessity, notes
+                    FROM tx_new_rows
+                """)
+            if changed_rows is not None:
+                # Tag normalizzati una volta in liste di str (non array numpy misti a liste):
+                # DuckDB legge la colonna come VARCHAR[] senza ispezionare cella per cella
+                changed_rows['tags'] = [_tag_list(t) for t in changed_rows['tags']]
+                self.con.register('tx_changed_rows', changed_rows[[
+                    'id', 'date', 'amount', 'type', 'category', 'description', 'necessity', 'tags', 'notes']])
+                self.con.execute("""
+                    UPDATE transactions AS t
+                    SET date = CAST(c.date AS DATE), amount = c.amount, type = c.type,
+                        category = c.category, description = c.description, necessity = c.necessity,
+                        tags = CAST(c.tags AS VARCHAR[]), notes = c.notes
+                    FROM tx_changed_rows AS c
+                    WHERE t.id = c.id
+                """)
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        finally:
+            self.con.unregister('tx_new_rows')
+            self.con.unregister('tx_changed_rows')
+        self.bump_data_version()
+        return (0 if new_rows is None else len(new_rows),
+                0 if changed_rows is None else len(changed_rows),
+                len(deleted_ids))
+
     def get_summary(self):
         return self.con.execute("""
             SELECT 
@@ -708,6 +967,258 @@ class DataManager:
         except:
             return []
 
+    def _rules_sql(self):
+        """
+        SELECT con i nuovi category/necessity/tags delle sole righe che le regole
+        cambiano: stessa semantica di RulesEngine.apply_rules seguito da
+        auto_tag_from_description, ma calcolata interamente in DuckDB. Come in
+        pandas, tag_necessity vede i tag delle regole ma non quelli da parole chiave.
+        """
+        rules = self.rules_engine.rules
+
+        def rx(rule):
+            return '|'.join(rule.get('match', []) or [])
+
+        def hit(pattern):
+            return f"regexp_matches(description, {_sql_lit(pattern)}, 'i')"
+
+        # Regole categoria: in pandas l'ultima che corrisponde vince -> CASE in ordine inverso
+        cat_rules = [r for r in rules.get('categories', []) or [] if rx(r)]
+        new_cat = "category"
+        if cat_rules:
+            new_cat = ("CASE " + " ".join(f"WHEN {hit(rx(r))} THEN {_sql_lit(r.get('name'))}"
+                                          for r in reversed(cat_rules)) + " ELSE category END")
+        nec_rules = [r for r in cat_rules if r.get('necessity')]
+        rule_nec = "NULL"
+        if nec_rules:
+            rule_nec = ("CASE " + " ".join(f"WHEN {hit(rx(r))} THEN {_sql_lit(r['necessity'])}"
+                                           for r in reversed(nec_rules)) + " END")
+
+        # Tag da regole (apply_rules) e da parole chiave (auto_tag_from_description),
+        # tenuti separati: tag_necessity gira prima delle parole chiave
+        def hits_list(hits):
+            return f"[{', '.join(hits)}]" if hits else "[]::VARCHAR[]"
+
+        rule_hits = hits_list([f"CASE WHEN {hit(rx(r))} THEN {_sql_lit(r.get('tag'))} END"
+                               for r in rules.get('tags', []) or [] if rx(r)])
+        kw_hits = hits_list([f"CASE WHEN {hit(kw)} THEN {_sql_lit(kw)} END" for kw in AUTO_TAG_KEYWORDS])
+
+        # Necessity: tag (l'ultimo della mappa vince) > categoria finale > regola categoria > 'Want'
+        cat_nec = {r['name']: r['necessity'] for r in rules.get('categories', []) or [] if r.get('necessity')}
+        cat_nec.update(rules.get('category_necessity', {}) or {})
+        tag_nec = rules.get('tag_necessity', {}) or {}
+        nec_whens = [f"WHEN list_contains(rule_tags, {_sql_lit(t)}) THEN {_sql_lit(n)}"
+                     for t, n in reversed(list(tag_nec.items()))]
+        nec_whens += [f"WHEN new_category = {_sql_lit(c)} THEN {_sql_lit(n)}" for c, n in cat_nec.items()]
+        nec_whens.append("WHEN rule_nec IS NOT NULL THEN rule_nec")
+
+        return f"""
+            WITH m AS (
+                SELECT id, category AS old_category, necessity AS old_necessity, tags AS old_tags,
+                       {new_cat} AS new_category,
+                       {rule_nec} AS rule_nec,
+                       list_filter({rule_hits}, x -> x IS NOT NULL) AS rule_matched,
+                       list_filter({kw_hits}, x -> x IS NOT NULL) AS kw_matched
+                FROM transactions
+            ), ra AS (
+                SELECT *,
+                       list_filter(rule_matched, (x, i) -> list_position(rule_matched, x) = i
+                                   AND NOT list_contains(coalesce(old_tags, []::VARCHAR[]), x)) AS rule_added
+                FROM m
+            ), r AS (
+                SELECT *,
+                       CASE WHEN len(rule_added) = 0 THEN old_tags
+                            ELSE list_concat(coalesce(old_tags, []::VARCHAR[]), rule_added) END AS rule_tags
+                FROM ra
+            ), ka AS (
+                SELECT *,
+                       list_filter(kw_matched, (x, i) -> list_position(kw_matched, x) = i
+                                   AND NOT list_contains(coalesce(rule_tags, []::VARCHAR[]), x)) AS kw_added
+                FROM r
+            ), t AS (
+                SELECT *,
+                       CASE WHEN len(kw_added) = 0 THEN rule_tags
+                            ELSE list_concat(coalesce(rule_tags, []::VARCHAR[]), kw_added) END AS new_tags
+                FROM ka
+            ), n AS (
+                SELECT *, CASE {' '.join(nec_whens)} ELSE 'Want' END AS new_necessity
+                FROM t
+            )
+            SELECT id, new_category AS category, new_necessity AS necessity, new_tags AS tags,
+                   old_category, old_necessity
+            FROM n
+            WHERE new_category IS DISTINCT FROM old_category
+               OR new_necessity IS DISTINCT FROM old_necessity
+               OR new_tags IS DISTINCT FROM old_tags
+        """
+
+    def reapply_rules(self):
+        """
+        Riapplica le regole a tutte le transazioni scrivendo solo le righe
+        cambiate. Il matching gira in DuckDB; se una regola non è accettata dal
+        motore regex di DuckDB (es. lookahead) si usa il percorso pandas.
+        Ritorna (transazioni, categorie aggiornate, necessity aggiornate).
+        """
+        total = self.con.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        if not total:
+            return 0, 0, 0
+        self.con.execute("BEGIN TRANSACTION")
+        try:
+            self.con.execute("CREATE TEMP TABLE rule_deltas AS " + self._rules_sql())
+            changed_cat, changed_nec, n = self.con.execute("""
+                SELECT COUNT(*) FILTER (WHERE category IS DISTINCT FROM old_category),
+                       COUNT(*) FILTER (WHERE necessity IS DISTINCT FROM old_necessity),
+                       COUNT(*)
+                FROM rule_deltas
+            """).fetchone()
+            self.con.execute("""
+                UPDATE transactions AS t
+                SET category = d.category, necessity = d.necessity, tags = d.tags
+                FROM rule_deltas AS d
+                WHERE t.id = d.id
+            """)
+            self.con.execute("DROP TABLE rule_deltas")
+            self.con.execute("COMMIT")
+        except duckdb.Error:
+            self.con.execute("ROLLBACK")
+            return self._reapply_rules_pandas()
+        if n:
+            self.bump_data_version()
+        return total, changed_cat, changed_nec
+
+    def _reapply_rules_pandas(self):
+        """Come reapply_rules, con RulesEngine su un DataFrame (regex Python)."""
+        df = self.get_transactions()
+        if df.empty:
+            return 0, 0, 0
+        # Snapshot prima delle regole (i tag come tuple: le regole
+        # possono modificare le liste in place)
+        before = df[['category', 'necessity']].copy()
+        before_tags = df['tags'].map(_tag_key)
+
+        df = self.rules_engine.apply_rules(df)
+        df = self.rules_engine.auto_tag_from_description(df)
+
+        cat_chg = _changed(df['category'], before['category'])
+        nec_chg = _changed(df['necessity'], before['necessity'])
+        tag_chg = df['tags'].map(_tag_key).ne(before_tags)
+
+        # Solo le righe cambiate tornano nel DB, con un UPDATE ... FROM
+        deltas = df.loc[cat_chg | nec_chg | tag_chg, ['id', 'category', 'necessity', 'tags']]
+        if not deltas.empty:
+            self.con.execute("BEGIN TRANSACTION")
+            try:
+                self.con.register('rule_deltas', deltas)
+                self.con.execute("""
+                    UPDATE transactions AS t
+                    SET category = d.category,
+                        necessity = d.necessity,
+                        tags = CAST(d.tags AS VARCHAR[])
+                    FROM rule_deltas AS d
+                    WHERE t.id = d.id
+                """)
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+            finally:
+                self.con.unregister('rule_deltas')
+            self.bump_data_version()
+        return len(df), int(cat_chg.sum()), int(nec_chg.sum())
+
+    def get_split_month(self, year, month, split_conf, default_tags=()):
+        """
+        Spese del mese con la quota dovuta dal partner, calcolata in DuckDB.
+
+        Priorità: tag prestito (100%) > regole per tag > regole per categoria
+        (nell'ordine configurato) > tag di condivisione generici (`default_tags`)
+        con la quota di default. I tag vengono confrontati in minuscolo e senza '#'.
+        Colonne extra: tags_clean (e il suo testo per il debug, tags_clean_txt),
+        bucket ('loan' | 'rule' | 'default' | NULL),
+        rule_kind, rule_match, my_share, owed, rule_name ('Default' per la quota di
+        default), partner_pct (quota partner in %) e share_desc (etichetta "50% (gas)").
+        """
+        def tag_list(tags):
+            return "[" + ", ".join(_sql_lit(clean_tag(t)) for t in tags) + "]::VARCHAR[]"
+
+        # Regole preparate una volta sola: (condizione SQL, regola), tag prima delle categorie
+        rules = split_conf.get('rules', []) or []
+        prepped = ([(f"list_contains(tags_clean, {_sql_lit(clean_tag(r['match']))})", r)
+                    for r in rules if r['type'] == 'tag'] +
+                   [(f"category = {_sql_lit(r['match'])}", r)
+                    for r in rules if r['type'] == 'category'])
+
+        def rule_case(value_of):
+            if not prepped:
+                return "NULL"
+            return "CASE " + " ".join(f"WHEN {cond} THEN {value_of(r)}" for cond, r in prepped) + " END"
+
+        default_partner = 1.0 - split_conf.get('default_share_pct', 50) / 100.0
+        return self.con.execute(f"""
+            WITH base AS (
+                SELECT date, description, category, amount, tags,
+                       list_transform(coalesce(tags, []::VARCHAR[]),
+                                      x -> trim(replace(lower(x), '#', ''))) AS tags_clean
+                FROM transactions
+                WHERE type = 'Expense' AND year(date) = ? AND month(date) = ?
+            ), m AS (
+                SELECT *,
+                       list_has_any(tags_clean, {tag_list(split_conf.get('loan_tags', []) or [])}) AS is_loan,
+                       {rule_case(lambda r: _sql_lit(r['type']))} AS rule_kind,
+                       {rule_case(lambda r: _sql_lit(str(r['match'])))} AS rule_match,
+                       {rule_case(lambda r: repr(r['my_share'] / 100.0))} AS my_share,
+                       list_has_any(tags_clean, {tag_list(default_tags)}) AS is_default
+                FROM base
+            ), b AS (
+                SELECT *,
+                       CASE WHEN is_loan THEN 'loan'
+                            WHEN rule_kind IS NOT NULL THEN CASE WHEN 1.0 - my_share > 0 THEN 'rule' END
+                            WHEN is_default THEN 'default'
+                       END AS bucket,
+                       CASE WHEN rule_kind IS NOT NULL THEN 1.0 - my_share ELSE {default_partner!r} END AS partner_share
+                FROM m
+            ), s AS (
+                SELECT *,
+                       CASE bucket WHEN 'rule' THEN rule_match WHEN 'default' THEN 'Default' END AS rule_name,
+                       CASE WHEN bucket IN ('rule', 'default')
+                            THEN CAST(trunc(partner_share * 100) AS INTEGER) END AS partner_pct
+                FROM b
+            )
+            SELECT date, description, category, amount, tags, tags_clean,
+                   '[' || array_to_string(list_transform(tags_clean, x -> chr(39) || x || chr(39)), ', ') || ']' AS tags_clean_txt,
+                   bucket, rule_kind, rule_match, my_share,
+                   CASE bucket WHEN 'loan' THEN abs(amount)
+                               WHEN 'rule' THEN abs(amount) * partner_share
+                               WHEN 'default' THEN abs(amount) * partner_share
+                               ELSE 0.0 END AS owed,
+                   rule_name, partner_pct,
+                   partner_pct || '% (' || rule_name || ')' AS share_desc
+            FROM s
+            ORDER BY date DESC
+        """, [int(year), int(month)]).df()
+
+    def get_expense_months(self):
+        """Coppie (anno, mese) con almeno una spesa, dalla più recente."""
+        return [(int(y), int(m)) for y, m in self.con.execute("""
+            SELECT DISTINCT year(date), month(date) FROM transactions
+            WHERE type = 'Expense' AND date IS NOT NULL
+            ORDER BY 1 DESC, 2 DESC
+        """).fetchall()]
+
+    def get_tag_frequencies(self):
+        """Numero di transazioni per tag, dal più usato (Series tag -> n)."""
+        try:
+            res = self.con.execute("""
+                SELECT tag, COUNT(*) AS n
+                FROM (SELECT unnest(tags) AS tag FROM transactions) t
+                WHERE tag IS NOT NULL AND tag != ''
+                GROUP BY tag
+                ORDER BY n DESC, tag
+            """).fetchall()
+        except Exception:
+            res = []
+        return pd.Series({t: n for t, n in res}, dtype='int64')
+
     def get_unique_tags(self):
         try:
             # Explode tags array (DuckDB specific unnest not always simple with list column in python-bound duckdb, 
@@ -909,6 +1420,7 @@ class DataManager:
             VALUES (uuid(), ?, ?, ?, ?, ?, ?, ?, ?, 'manual_entry', ?, ?)
         """, [date, amt, currency, account, final_category, final_tags, description,
               ttype, description, final_necessity])
+        self.bump_data_version()
         return True
 
     def _necessity_from_rules(self, category, tags):
@@ -955,6 +1467,7 @@ class DataManager:
             )
         except Exception:
             pass
+        self.bump_data_version()
 
         if update_rules:
             rules = self.rules_engine.rules or {}
@@ -1035,7 +1548,8 @@ class DataManager:
                     WHERE list_contains(tags, ?)
                  """
                  self.con.execute(q_rec, [old_tag, old_tag])
-                 
+
+            self.bump_data_version()
             return True, f"Updated tag '{old_tag}' to '{new_tag}'"
         except Exception as e:
             return False, str(e)
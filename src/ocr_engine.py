@@ -1,9 +1,14 @@
+import io
 import re
 import datetime
+import threading
 
 class OCREngine:
     def __init__(self):
         self.reader = None
+        # L'istanza è condivisa tra le sessioni (st.cache_resource): il lock serializza
+        # il caricamento del modello e le chiamate a readtext, che non sono thread-safe
+        self._lock = threading.Lock()
 
     def _get_reader(self):
         """Lazy load the reader to save RAM when not in use."""
@@ -28,12 +33,34 @@ class OCREngine:
                 )
         return self.reader
 
+    @staticmethod
+    def _prepare_image(image_bytes, max_side=1600):
+        """
+        Scala di grigi e lato lungo al massimo `max_side` px: il tempo dell'OCR cresce
+        con i pixel e per gli screenshot delle app bancarie la risoluzione piena non serve.
+        Se l'immagine non si apre, restituisce i byte originali.
+        """
+        try:
+            from PIL import Image
+            img = Image.open(io.BytesIO(image_bytes))
+            img = img.convert('L')
+            w, h = img.size
+            scale = min(1.0, max_side / max(w, h))
+            if scale < 1.0:
+                img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, 'PNG')
+            return buf.getvalue()
+        except Exception:
+            return image_bytes
+
     def extract_transaction_data(self, image_bytes):
         """
         Parses an image and returns a list of proposed transactions.
         Returns: (transactions, raw_text_lines)
         """
-        reader = self._get_reader()
+        with self._lock:
+            reader = self._get_reader()
         
         # detail=0 returns just text list
         # paragraph=False returns distinct lines which might be better for this split logic?
@@ -41,7 +68,9 @@ class OCREngine:
         # Let's stick to paragraph=True but rely on the list order.
         # If paragraph=True groups them weirdly, we might want detail=0. 
         # But let's trust the user's list implies sequential processing works.
-        results = reader.readtext(image_bytes, paragraph=True) 
+        image_bytes = self._prepare_image(image_bytes)
+        with self._lock:
+            results = reader.readtext(image_bytes, paragraph=True)
         
         transactions = []
         raw_text_lines = []
@@ -2,6 +2,13 @@ import yaml
 import re
 import pandas as pd
 
+# Parole chiave aggiunte come tag quando compaiono nella descrizione
+AUTO_TAG_KEYWORDS = ['luce', 'gas', 'internet', 'taxi', 'uber', 'amazon']
+
+# Versione delle regole per rules_path, incrementata a ogni salvataggio: fa da
+# chiave per le cache della UI (come _DATA_VERSIONS in data_manager).
+_RULES_VERSIONS = {}
+
 class RulesEngine:
     def __init__(self, rules_path=None):
         import os
@@ -11,6 +18,11 @@ class RulesEngine:
         self.rules_path = rules_path
         self.rules = self.load_rules()
 
+    @property
+    def version(self):
+        """Contatore dei salvataggi del file regole."""
+        return _RULES_VERSIONS.get(self.rules_path, 0)
+
     def load_rules(self):
         try:
             with open(self.rules_path, 'r') as f:
@@ -23,8 +35,10 @@ class RulesEngine:
 
     def save_rules(self, new_rules):
         with open(self.rules_path, 'w') as f:
-            yaml.dump(new_rules, f)
+            # Emitter C di libyaml quando disponibile (stesso output, molto più veloce)
+            yaml.dump(new_rules, f, Dumper=getattr(yaml, 'CDumper', yaml.Dumper))
         self.rules = new_rules
+        _RULES_VERSIONS[self.rules_path] = self.version + 1
 
     def apply_rules(self, df, respect_existing_category=False):
         """Applies categorization and tagging rules to the dataframe.
@@ -112,18 +126,19 @@ class RulesEngine:
                 if hasattr(t, 'tolist'): return t.tolist()
                 return []
 
+            # Un solo passaggio Python per appiattire i tag (indice = posizione della riga),
+            # poi per ogni tag un confronto vettoriale invece di un apply sull'intera colonna
+            flat = pd.Series([get_tags_list(t) for t in df['tags']], dtype=object).explode()
             for tag, nec in tag_necessity_map.items():
-                mask = df['tags'].apply(lambda t, _tag=tag: _tag in get_tags_list(t))
-                df.loc[mask, 'necessity'] = nec
+                hit = flat.eq(tag).groupby(level=0).any().to_numpy()
+                df.loc[hit, 'necessity'] = nec
 
         return df
 
     def auto_tag_from_description(self, df):
         """Extracts common keywords as tags if not already present."""
         # Simple keyword extraction (naive)
-        keywords = ['luce', 'gas', 'internet', 'taxi', 'uber', 'amazon']
-        
-        for kw in keywords:
+        for kw in AUTO_TAG_KEYWORDS:
             mask = df['description'].str.contains(kw, case=False, na=False)
             
             def add_kw_tag(row_tags):
@@ -155,21 +170,14 @@ class RulesEngine:
         valid_hist = history_df[history_df['category'].notna()].copy()
         valid_hist['desc_clean'] = valid_hist['description'].str.strip().str.lower()
         
-        # Get mode category for each description
-        lookup = {}
-        # Iterate unique descriptions
-        for desc in valid_hist['desc_clean'].unique():
-            if not desc: continue
-            
-            # Find rows
-            mask = valid_hist['desc_clean'] == desc
-            cats = valid_hist.loc[mask, 'category']
-            
-            if not cats.empty:
-                # Top frequent category
-                top_cat = cats.mode().iloc[0]
-                lookup[desc] = top_cat
-                
+        # Categoria più frequente per descrizione (a parità, la prima in ordine
+        # alfabetico, come mode()): un solo groupby invece di una maschera per descrizione
+        valid_hist = valid_hist[valid_hist['desc_clean'].fillna('') != '']
+        counts = valid_hist.groupby(['desc_clean', 'category']).size().reset_index(name='n')
+        top = (counts.sort_values(['n', 'category'], ascending=[False, True], kind='stable')
+                     .drop_duplicates('desc_clean'))
+        lookup = dict(zip(top['desc_clean'], top['category']))
+
         self.history_lookup = lookup
         return lookup
 
@@ -50,9 +50,15 @@ def _tags_list(t):
     return t if isinstance(t, list) else []
 
 
-def _is_subscription(tags):
-    """True se la transazione ha un tag di servizio in abbonamento."""
-    return any(str(x).lower() in SUBSCRIPTION_TAGS for x in _tags_list(tags))
+def _tag_hits(tags, wanted):
+    """
+    Maschera (Series bool allineata a `tags`) delle righe con almeno un tag in
+    `wanted` (set, confronto in minuscolo): un explode + isin hash invece di
+    un any(... in ...) per riga.
+    """
+    flat = pd.Series(tags.map(_tags_list).to_numpy(), dtype=object).explode().dropna()
+    hit = flat.astype(str).str.lower().isin(wanted).groupby(level=0).any()
+    return pd.Series(hit.reindex(range(len(tags)), fill_value=False).to_numpy(dtype=bool), index=tags.index)
 
 
 def render_analysis(data_manager: DataManager):
@@ -78,25 +84,31 @@ def render_analysis(data_manager: DataManager):
     mode_label = af1.selectbox("Periodo", list(mode_map.keys()), index=0, key='ana_mode')
     filter_mode = mode_map[mode_label]
 
-    filtered_df = df.copy()
+    # Una sola maschera booleana e un solo slice finale; senza filtro niente copia
+    # (le viste copiano già prima di aggiungere colonne)
     years = sorted(df['year'].unique(), reverse=True)
+    mask = None
 
     if filter_mode == "Year":
         selected_year = af2.selectbox("Anno", years, key='ana_year')
-        filtered_df = df[df['year'] == selected_year]
+        mask = df['year'] == selected_year
     elif filter_mode == "Month":
         selected_year = af2.selectbox("Anno", years, key='ana_year_m')
         selected_month = af3.selectbox("Mese", list(range(1, 13)), index=int(today.month) - 1,
                                        format_func=lambda m: month_names[m], key='ana_month')
-        filtered_df = df[(df['year'] == selected_year) & (df['month'] == selected_month)]
+        mask = df['year'] == selected_year
+        mask &= df['month'] == selected_month
     elif filter_mode == "Custom":
         start_date = af2.date_input("Da", min_date, key='ana_start')
         end_date = af3.date_input("A", max_date, key='ana_end')
         if start_date <= end_date:
-            filtered_df = df[(df['date'].dt.date >= start_date) & (df['date'].dt.date <= end_date)]
+            mask = df['date'] >= pd.Timestamp(start_date)
+            mask &= df['date'] < pd.Timestamp(end_date) + pd.Timedelta(days=1)
         else:
             st.error("La data iniziale deve precedere quella finale.")
 
+    filtered_df = df[mask] if mask is not None else df
+
     # Selettore vista: renderizza SOLO l'analisi scelta (molto più fluido delle st.tabs,
     # che invece calcolano tutte le schede a ogni interazione).
     views = ["Smart Insights", "Income", "Tag", "Needs vs Wants",
@@ -355,7 +367,7 @@ def render_smart_insights(full_df, filtered_df, data_manager=None):
 
     # Abbonamenti reali: tag di servizio (non il generico 'abbonamento', che
     # include gli abbonamenti dei trasporti) + tabella ricorrenti
-    sub_mask = filtered_df['tags'].apply(_is_subscription)
+    sub_mask = _tag_hits(filtered_df['tags'], SUBSCRIPTION_TAGS)
     subs = filtered_df[sub_mask & (filtered_df['type'] == 'Expense')].copy()
 
     # Also pull from recurring_expenses (if data_manager available)
@@ -363,7 +375,7 @@ def render_smart_insights(full_df, filtered_df, data_manager=None):
     rec_names = []
     if data_manager is not None:
         try:
-            rec_df = data_manager.get_recurring()
+            rec_df = data_manager.get_recurring(cols=['name', 'amount', 'frequency'])
             if not rec_df.empty:
                 def to_monthly(row):
                     amt = abs(row['amount'])
@@ -1572,14 +1584,15 @@ def render_category_deepdive(full_df, filtered_df, data_manager):
     # Spese per tag: i tag funzionano come sotto-categorie
     st.markdown("#### 🏷️ Spese per Tag (sotto-categorie)")
     st.caption("Es. dentro 'Spesa alimentare': supermercato, mercato, macellaio… Una transazione con più tag conta in ciascuno.")
-    td = cat_df.explode('tags')
-    td['tags'] = td['tags'].astype(str).str.strip()
-    td = td[~td['tags'].isin(['nan', 'None', ''])]
+    # Explode solo delle due colonne che servono, con dtype "string" (non object)
+    td = cat_df[['tags', 'abs_amount']].explode('tags', ignore_index=True).dropna(subset=['tags'])
+    td['tags'] = td['tags'].astype('string').str.strip()
+    td = td[(td['tags'].str.len() > 0) & ~td['tags'].isin(['nan', 'None'])]
 
     if td.empty:
         st.caption("Nessun tag nelle transazioni di questa categoria — aggiungi tag per avere le sotto-categorie.")
     else:
-        tag_sum = (td.groupby('tags')['abs_amount']
+        tag_sum = (td.groupby('tags', sort=False)['abs_amount']
                      .agg(['sum', 'count', 'mean']).reset_index()
                      .sort_values('sum', ascending=False))
         tag_sum.columns = ['Tag', 'Totale', 'Volte', 'Media']
@@ -1766,19 +1779,13 @@ def render_financial_health(full_df, data_manager):
     FIXED_CATS = {'fatture', 'affitto', 'alloggio'}
     FIXED_DESC_KW = ('mutuo', 'affitto', 'condominio')
 
-    def _is_fixed(row):
-        t = row['tags']
-        if hasattr(t, 'tolist'):
-            t = t.tolist()
-        if isinstance(t, list) and any(str(x).lower() in FIXED_TAGS for x in t):
-            return True
-        if str(row['category']).lower() in FIXED_CATS:
-            return True
-        desc = str(row['description']).lower()
-        return any(kw in desc for kw in FIXED_DESC_KW)
+    is_fixed = (_tag_hits(exp['tags'], FIXED_TAGS)
+                | exp['category'].astype(str).str.lower().isin(FIXED_CATS)
+                | exp['description'].astype(str).str.lower()
+                    .str.contains('|'.join(FIXED_DESC_KW), regex=True, na=False))
 
     exp2 = exp.copy()
-    exp2['tipo'] = exp2.apply(lambda r: 'Fissa' if _is_fixed(r) else 'Variabile', axis=1)
+    exp2['tipo'] = np.where(is_fixed, 'Fissa', 'Variabile')
     fv = exp2.groupby(['my', 'tipo'])['abs_amount'].sum().reset_index()
     fv['mese'] = fv['my'].astype(str)
     fig_fv = px.area(fv, x='mese', y='abs_amount', color='tipo',
@@ -1804,7 +1811,7 @@ def render_financial_health(full_df, data_manager):
 
     # Abbonamenti configurati nelle ricorrenti (fonte di verità dell'utente)
     try:
-        rec = data_manager.get_recurring()
+        rec = data_manager.get_recurring(cols=['name', 'amount', 'frequency'])
     except Exception:
         rec = pd.DataFrame()
     if not rec.empty:
@@ -1817,7 +1824,7 @@ def render_financial_health(full_df, data_manager):
                        " · ".join(f"{r['name']} €{abs(r['amount']):,.0f}/{str(r.get('frequency','Monthly'))[:3].lower()}"
                                   for _, r in sub_rec.iterrows()))
 
-    subs = exp[exp['tags'].apply(_is_subscription)]
+    subs = exp[_tag_hits(exp['tags'], SUBSCRIPTION_TAGS)]
     if subs.empty:
         st.caption("Nessuna spesa con tag di servizio in abbonamento.")
     else:
@@ -3,71 +3,464 @@ import plotly.express as px
 import pandas as pd
 import plotly.graph_objects as go
 from src.data_manager import DataManager
-import datetime
+import numpy as np
 import calendar
+import os
+import re
+from datetime import date
+from itertools import chain
 from src.ui.styling import get_chart_colors
 from src.rules_engine import RulesEngine
-from src.ui.analysis import real_income, real_expenses
+from src.ui.analysis import real_income, real_expenses, _tags_list
+
+MONTH_NAMES = {1: "Gen", 2: "Feb", 3: "Mar", 4: "Apr", 5: "Mag", 6: "Giu",
+               7: "Lug", 8: "Ago", 9: "Set", 10: "Ott", 11: "Nov", 12: "Dic"}
+
+# Icona del wallet dedotta dal nome (prima corrispondenza vince), compilata una volta
+WALLET_ICON_PATTERNS = [
+    (re.compile(r'contanti|cash|tasca'), "💵"),
+    (re.compile(r'banca|bank|unicredit|intesa|bnl|posta|conto'), "🏦"),
+    (re.compile(r'revolut|paypal|satispay|visa|mastercard|amex'), "💳"),
+    (re.compile(r'risparmi|fondo|deposito|salvadanaio'), "🐷"),
+    (re.compile(r'invest|trade|crypto|bitcoin'), "📈"),
+]
+
+
+# Formattazione lato client (Arrow numerico, niente stringhe pre-formattate in Python)
+EUR_COL = st.column_config.NumberColumn("Importo", format="€%.2f")
+PCT_COL = st.column_config.NumberColumn("%", format="%.1f%%")
+
+
+# Stile delle card dei wallet: definito una volta, le card usano solo le classi
+WALLET_CARD_CSS = (
+    "<style>"
+    ".wallet-grid{display:grid;grid-template-columns:repeat(3,1fr);gap:12px;margin-bottom:12px;}"
+    ".wallet-card{border:1px solid rgba(49,51,63,0.2);border-radius:8px;padding:12px 16px;}"
+    ".wallet-name{font-weight:700;margin-bottom:4px;}"
+    ".wallet-bal{margin:0;}"
+    ".wallet-bal.pos{color:#2E7D32;}"
+    ".wallet-bal.neg{color:#C62828;}"
+    ".wallet-badge{background:#FFF3E0;color:#E65100;border-radius:4px;padding:1px 6px;"
+    "font-size:0.7em;font-weight:700;}"
+    "</style>"
+)
+
+
+# Colonne aggiunte da _load_and_prepare (nascoste nella vista "tutte le transazioni")
+DERIVED_COLS = ['month_date', 'is_income', 'is_expense', 'abs_amount', 'income_amt', 'expense_amt',
+                'cumulative_balance']
+
+
+def _tag_breakdown(tags, amounts):
+    """
+    Somma `amounts` per tag (una transazione può avere più tag) senza explode:
+    appiattisce le liste di tag, ripete gli importi allineati e riduce per chiave
+    ordinata con np.add.reduceat.
+    Ritorna (DataFrame [tags, abs_amount] ordinato per importo, totale senza tag).
+    """
+    tag_lists = [[str(t) for t in _tags_list(x) if t and str(t) not in ('nan', 'None')]
+                 for x in tags]
+    counts = np.fromiter(map(len, tag_lists), dtype=np.intp, count=len(tag_lists))
+    amt = np.asarray(amounts, dtype=float)
+    untagged = float(amt[counts == 0].sum())
+    if not counts.any():
+        return pd.DataFrame(columns=['tags', 'abs_amount']), untagged
+
+    tag_arr = np.asarray(list(chain.from_iterable(tag_lists)))
+    amt_rep = np.repeat(amt, counts)
+    order = tag_arr.argsort(kind='stable')
+    keys = tag_arr[order]
+    uniq, start = np.unique(keys, return_index=True)
+    sums = np.add.reduceat(amt_rep[order], start)
+    out = pd.DataFrame({'tags': uniq, 'abs_amount': sums})
+    return out.sort_values('abs_amount', ascending=False, kind='stable').reset_index(drop=True), untagged
+
+
+PIE_OTHER_LABEL = "Altre (<1%)"
+
+
+def _pie_slices(by_cat, min_share=0.01):
+    """
+    Accorpa le fette sotto `min_share` del totale in un'unica voce PIE_OTHER_LABEL:
+    meno fette = figura più leggera. `by_cat` è una Series categoria -> importo
+    già ordinata per importo decrescente.
+    """
+    total = by_cat.sum()
+    if total <= 0:
+        return by_cat
+    small = by_cat < min_share * total
+    if small.sum() < 2:
+        return by_cat
+    out = by_cat[~small].copy()
+    out[PIE_OTHER_LABEL] = by_cat[small].sum()
+    return out
+
+
+def _file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def _rules_engine(rules_path, mtime):
+    """RulesEngine condiviso (sola lettura): `mtime` nella chiave lo ricarica quando il file cambia."""
+    return RulesEngine(rules_path)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_and_prepare(_dm, db_path, data_version):
+    """
+    Transazioni pronte per la dashboard (date, anno/mese, categoriche, maschere).
+    La chiave è (db_path, data_version): finché il DB non cambia, i rerun non
+    rieseguono né la query né le conversioni.
+    """
+    df = _dm.get_transactions()
+    if df.empty:
+        return df
+
+    # Ensure date is datetime (DuckDB restituisce già datetime64 per le colonne DATE;
+    # si parsa solo se arrivano stringhe, con il fast path ISO)
+    if not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = pd.to_datetime(df['date'], format='ISO8601', cache=True)
+    # Ordinato per data: i filtri di periodo diventano slice via searchsorted (_date_slice)
+    df = df.sort_values('date', kind='stable', ignore_index=True)
+    df['year'] = df['date'].dt.year
+    df['month'] = df['date'].dt.month
+    df['month_date'] = df['date'].to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    # Colonne a bassa cardinalità come categoriche: groupby/confronti sui codici
+    for c in ('category', 'account', 'type', 'currency', 'necessity'):
+        df[c] = df[c].astype('category')
+    # Maschere Income/Expense calcolate una volta (i tipi non sono solo due: transfer, adjustment)
+    df['is_income'] = (df['type'] == 'Income').to_numpy()
+    df['is_expense'] = (df['type'] == 'Expense').to_numpy()
+    # Importi derivati una volta sola: le sezioni sotto leggono senza copiare il frame
+    df['abs_amount'] = df['amount'].abs()
+    df['income_amt'] = df['amount'].where(df['is_income'], 0.0)
+    df['expense_amt'] = df['amount'].where(df['is_expense'], 0.0)
+    # Patrimonio cumulato: il frame è già ordinato per data, basta la somma progressiva
+    df['cumulative_balance'] = df['amount'].cumsum()
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _wallet_balances(_df, db_path, data_version):
+    """Saldo per conto sull'intero dataset: non dipende dai filtri, solo dai dati."""
+    return _df.groupby('account', observed=True, sort=False)['amount'].sum().reset_index()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _networth_daily(_df, db_path, data_version):
+    """Patrimonio cumulato a fine giornata sull'intero dataset: [date, cumulative_balance]."""
+    # cumulative_balance arriva da _load_and_prepare (frame ordinato): niente sort né cumsum qui
+    return _df.groupby('date', sort=False)['cumulative_balance'].last().reset_index()
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _projected_recurring(_dm, end_date, db_path, data_version):
+    """Ricorrenze proiettate fino a `end_date`: dipendono solo dal DB, non dai widget."""
+    return _dm.get_projected_recurring(end_date)
+
+
+def _lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: indici di `n_out` punti che conservano la forma
+    della serie (x numerico crescente, y). Primo e ultimo punto sempre inclusi.
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    idx = np.empty(n_out, dtype=np.intp)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x, avg_y = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def _date_slice(df, start, end):
+    """Righe con start <= date < end. `df` è ordinato per data: due searchsorted, nessuna maschera."""
+    lo, hi = np.searchsorted(df['date'].to_numpy(), [np.datetime64(start), np.datetime64(end)], side='left')
+    return df.iloc[lo:hi]
+
+
+def _month_bounds(year, month):
+    start = pd.Timestamp(year, month, 1)
+    return start, start + pd.DateOffset(months=1)
+
+
+def _year_bounds(year):
+    return pd.Timestamp(year, 1, 1), pd.Timestamp(year + 1, 1, 1)
+
+
+def _wallet_icons(accounts, wallet_rules):
+    """
+    Icona per ogni wallet in un solo passaggio vettoriale: np.select sulle maschere
+    str.contains mantiene la priorità di WALLET_ICON_PATTERNS; le icone scelte a
+    mano in rules.yaml hanno la precedenza.
+    """
+    accounts = pd.Series(accounts, dtype='string')
+    lc = accounts.str.lower()
+    icons = pd.Series(np.select([lc.str.contains(p, regex=True, na=False).to_numpy() for p, _ in WALLET_ICON_PATTERNS],
+                                [icon for _, icon in WALLET_ICON_PATTERNS], default="👛"), index=accounts.index)
+    custom = accounts.map({k: v['icon'] for k, v in wallet_rules.items() if isinstance(v, dict) and 'icon' in v})
+    return custom.fillna(icons).tolist()
+
+
+def _cashflow_pivot(df, idx):
+    """
+    Entrate/Spese/Saldo per `idx` (giorno o mese): una riga per periodo con
+    colonne [idx, Income, Expense, Balance]. Un solo groupby con aggregazione
+    nominata sulle colonne precalcolate income_amt/expense_amt, niente pivot.
+    """
+    grp = (df[[idx, 'income_amt', 'expense_amt']]
+           .groupby(idx, sort=True)
+           .agg(Income=('income_amt', 'sum'), Expense=('expense_amt', 'sum')))
+    grp['Balance'] = grp['Income'] + grp['Expense']
+    return grp.reset_index()
+
+
+def _cashflow_figure(stats, idx, title, barmode='overlay', **layout):
+    """Barre entrate/spese mensili + linea del saldo netto (figura costruita in un colpo solo)."""
+    return go.Figure(
+        data=[
+            go.Bar(x=stats[idx], y=stats['Income'], name='Income', marker_color='#4CAF50'),
+            go.Bar(x=stats[idx], y=stats['Expense'], name='Expenses', marker_color='#EF5350'),
+            go.Scatter(x=stats[idx], y=stats['Balance'], name='Net Balance', mode='lines+markers',
+                       line=dict(color='#2196F3', width=3),
+                       marker=dict(size=8) if barmode == 'overlay' else None),
+        ],
+        layout=go.Layout(title=title, barmode=barmode, hovermode="x unified",
+                         uirevision='dashboard', **layout),
+    )
+
+
+def _filter_views(df, key):
+    """
+    Frame derivati dai filtri (filtrato / entrate / spese con abs_amount),
+    memorizzati in session_state sotto `key` = (db_path, data_version, filtri...):
+    un rerun con gli stessi filtri e gli stessi dati li riusa senza rifiltrare.
+    I frame restituiti vanno trattati come sola lettura.
+    """
+    cached = st.session_state.get('_dash_views')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    _, _, filter_mode, year, month, start_date, end_date, accounts = key
+    if filter_mode == "Year":
+        filtered_df = _date_slice(df, *_year_bounds(year))
+    elif filter_mode == "Month":
+        filtered_df = _date_slice(df, *_month_bounds(year, month))
+    elif filter_mode == "Custom" and start_date <= end_date:
+        # Finestra semiaperta [start, end + 1 giorno)
+        filtered_df = _date_slice(df, pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1))
+    else:
+        filtered_df = df
+    if accounts:
+        filtered_df = filtered_df[filtered_df['account'].isin(accounts)]
+
+    views = {
+        'filtered': filtered_df,
+        'income': filtered_df[filtered_df['is_income']],
+        'expense': filtered_df[filtered_df['is_expense']],
+    }
+    st.session_state['_dash_views'] = (key, views)
+    return views
+
+
+@st.fragment
+def _render_month_calendar(mm, filtered_df, selected_year, selected_month):
+    """
+    Heatmap delle spese del mese + dettaglio per giorno. È un fragment: cambiare
+    il giorno selezionato riesegue solo questo blocco, non l'intera dashboard.
+    """
+    # Toggle invece di expander: il corpo di un expander chiuso viene comunque
+    # eseguito, così heatmap e drill-down si calcolano solo quando servono
+    if not st.toggle("📅 Calendario spese del mese", key="show_month_cal"):
+        return
+    day_exp = mm.groupby(mm['date'].dt.day, sort=False)['abs_amount'].sum()
+    weeks = calendar.Calendar(firstweekday=0).monthdayscalendar(selected_year, selected_month)
+    z, txt = [], []
+    for wk in weeks:
+        zr, tr = [], []
+        for d in wk:
+            if d == 0:
+                zr.append(None); tr.append("")
+            else:
+                v = float(day_exp.get(d, 0) or 0)
+                zr.append(v)
+                tr.append(f"<b>{d}</b><br>€{v:,.0f}" if v > 0 else f"{d}")
+        z.append(zr); txt.append(tr)
+    x_lbl = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
+    y_lbl = [f"S{i+1}" for i in range(len(weeks))]
+    fig_cal = go.Figure(go.Heatmap(
+        z=z, text=txt, texttemplate="%{text}", hoverinfo='text',
+        x=x_lbl, y=y_lbl, colorscale='Oranges', showscale=False, xgap=3, ygap=3))
+    fig_cal.update_yaxes(autorange='reversed', showticklabels=False)
+    fig_cal.update_layout(height=70 + len(weeks) * 60,
+                          margin=dict(l=6, r=6, t=6, b=6))
+    st.plotly_chart(fig_cal, use_container_width=True, key="cal_heat")
+    # Drill-down per giorno (selettore affidabile: il click sulla heatmap
+    # non è supportato in modo affidabile da Streamlit)
+    days_with = [int(d) for d in sorted(day_exp[day_exp > 0].index.tolist())]
+    if days_with:
+        day_opts = ["—"] + [f"{d} {MONTH_NAMES[selected_month]} · €{day_exp.get(d, 0):,.0f}"
+                            for d in days_with]
+        sel_day_lbl = st.selectbox("👉 Vedi le spese di un giorno", day_opts, key="cal_day_sel")
+        if sel_day_lbl != "—":
+            dnum = int(sel_day_lbl.split()[0])
+            day_tx = filtered_df[filtered_df['date'].dt.day == dnum]
+            st.markdown(f"**Transazioni del {dnum} {MONTH_NAMES[selected_month]}** — "
+                        f"€{day_exp.get(dnum, 0):,.2f}")
+            st.dataframe(day_tx[['date', 'description', 'category', 'amount', 'tags']]
+                         .sort_values('date'), hide_index=True, use_container_width=True)
+
+
+@st.fragment
+def _render_income_breakdown(income_df):
+    """Torta entrate per categoria con drill-down (fragment: il click non rilancia la pagina)."""
+    st.subheader("Income Sources")
+    if not income_df.empty:
+        income_by_cat = _pie_slices(
+            income_df.groupby('category', observed=True, sort=False)['amount'].sum().sort_values(ascending=False))
+        fig_inc = px.pie(values=income_by_cat.values, names=income_by_cat.index, hole=0.4)
+        inc_event = st.plotly_chart(fig_inc, use_container_width=True, on_select="rerun", key="pie_income")
+        # Drill-down
+        if inc_event and inc_event.selection and inc_event.selection.points:
+            sel_cat = inc_event.selection.points[0].get('label')
+            if sel_cat and sel_cat != PIE_OTHER_LABEL:
+                st.markdown(f"**Transactions — {sel_cat}**")
+                drill = income_df[income_df['category'] == sel_cat][['date','description','amount','tags']].sort_values('date', ascending=False)
+                st.dataframe(drill, use_container_width=True, hide_index=True)
+    else:
+        st.info("No income data for this period.")
+
+
+@st.fragment
+def _render_expense_breakdown(expense_df):
+    """
+    Torta + tabella spese per categoria con dettaglio per tag della categoria
+    selezionata (fragment: click su torta/tabella rieseguono solo questo blocco).
+    """
+    st.subheader("Spese per Categoria")
+    if not expense_df.empty:
+        exp_total = expense_df['abs_amount'].sum()
+        exp_by_cat_s = expense_df.groupby('category', observed=True, sort=False)['abs_amount'].sum().sort_values(ascending=False)
+        exp_by_cat = exp_by_cat_s.reset_index()
+        exp_pie = _pie_slices(exp_by_cat_s)
+        fig_exp = px.pie(values=exp_pie.values, names=exp_pie.index, hole=0.4)
+        exp_event = st.plotly_chart(fig_exp, use_container_width=True, on_select="rerun", key="pie_expense")
+        st.caption("👆 Clicca una categoria (torta o tabella) per il dettaglio per tag.")
+
+        # Tabella categorie (importo + %) — sempre visibile
+        cat_show = exp_by_cat.assign(pct=exp_by_cat['abs_amount'] / exp_total * 100)
+        cat_sel_event = st.dataframe(
+            cat_show[['category', 'abs_amount', 'pct']],
+            use_container_width=True, hide_index=True,
+            on_select="rerun", selection_mode="single-row", key="cat_table",
+            column_config={"category": "Categoria", "abs_amount": EUR_COL, "pct": PCT_COL}
+        )
+
+        # Categoria selezionata: dalla torta o dalla riga della tabella
+        sel_cat = None
+        if exp_event and exp_event.selection and exp_event.selection.points:
+            sel_cat = exp_event.selection.points[0].get('label')
+            if sel_cat == PIE_OTHER_LABEL:
+                sel_cat = None
+        elif cat_sel_event and cat_sel_event.selection and cat_sel_event.selection.rows:
+            sel_cat = exp_by_cat.iloc[cat_sel_event.selection.rows[0]]['category']
+
+        if sel_cat:
+            cat_data = expense_df[expense_df['category'] == sel_cat]
+            cat_total = cat_data['abs_amount'].sum()
+            st.markdown(f"#### 📂 {sel_cat} — €{cat_total:,.2f} ({cat_total/exp_total*100:.0f}% del mese)")
+
+            # Sotto-ripartizione per tag (sottocategorie)
+            tag_break, untag = _tag_breakdown(cat_data['tags'], cat_data['abs_amount'])
+            if not tag_break.empty:
+                tag_break['%'] = tag_break['abs_amount'] / cat_total * 100
+                fig_tb = px.bar(tag_break.head(12), x='tags', y='abs_amount', text='%',
+                                title=f"Per tag — {sel_cat}")
+                fig_tb.update_traces(texttemplate='%{text:.0f}%')
+                fig_tb.update_layout(height=280, showlegend=False, xaxis_title='', yaxis_title='€')
+                st.plotly_chart(fig_tb, use_container_width=True)
+
+                st.dataframe(tag_break[['tags', 'abs_amount', '%']], use_container_width=True,
+                             hide_index=True, column_config={"tags": "Tag", "abs_amount": EUR_COL, "%": PCT_COL})
+
+                if untag > 0:
+                    st.caption(f"Senza tag: €{untag:,.2f} ({untag/cat_total*100:.0f}%)")
+            else:
+                st.caption("Nessun tag in questa categoria.")
+
+            st.markdown("**Transazioni**")
+            drill = cat_data[['date', 'description', 'amount', 'tags']].sort_values('date', ascending=False)
+            st.dataframe(drill, use_container_width=True, hide_index=True)
+    else:
+        st.info("No expense data for this period.")
+
 
 def render_dashboard(data_manager):
     st.header("Dashboard")
     
-    # Load rules for icons
-    re = RulesEngine()
-    wallet_rules = re.rules.get('wallets', {})
+    # Load rules for icons (riletto solo quando rules.yaml cambia)
+    rules_path = data_manager.rules_engine.rules_path
+    rules_engine = _rules_engine(rules_path, _file_mtime(rules_path))
+    wallet_rules = rules_engine.rules.get('wallets', {})
     main_wallet = data_manager.get_main_wallet()
     
     try:
-        df = data_manager.get_transactions()
+        df = _load_and_prepare(data_manager, data_manager.db_path, data_manager.data_version)
         if df.empty:
             st.info("No data available. Please import a ZIP file.")
             return
 
-        # Ensure date is datetime
-        df['date'] = pd.to_datetime(df['date'])
-        df['year'] = df['date'].dt.year
-        df['month'] = df['date'].dt.month
-
         # Filtri periodo — barra compatta in alto (spostati dalla sidebar)
         min_date = df['date'].min().date()
         max_date = df['date'].max().date()
-        today = datetime.date.today()
-        month_names = {1:"Gen",2:"Feb",3:"Mar",4:"Apr",5:"Mag",6:"Giu",
-                       7:"Lug",8:"Ago",9:"Set",10:"Ott",11:"Nov",12:"Dic"}
+        today = date.today()
 
         mode_map = {"Mese": "Month", "Anno": "Year", "Personalizzato": "Custom", "Tutto": "All Time"}
         f1, f2, f3, f4 = st.columns([1.2, 1.2, 1.2, 2.2])
         mode_label = f1.selectbox("Periodo", list(mode_map.keys()), index=0)
         filter_mode = mode_map[mode_label]
 
-        filtered_df = df.copy()
         selected_year = None
         selected_month = None
+        start_date = end_date = None
 
         available_years = sorted(list(set(df['year'].unique()) | {today.year}), reverse=True)
         default_year_idx = available_years.index(today.year) if today.year in available_years else 0
 
         if filter_mode == "Year":
             selected_year = f2.selectbox("Anno", available_years, index=default_year_idx)
-            filtered_df = df[df['year'] == selected_year]
         elif filter_mode == "Month":
             selected_year = f2.selectbox("Anno", available_years, index=default_year_idx)
             selected_month = f3.selectbox("Mese", list(range(1, 13)), index=today.month - 1,
-                                          format_func=lambda m: month_names[m])
-            filtered_df = df[(df['year'] == selected_year) & (df['month'] == selected_month)]
+                                          format_func=lambda m: MONTH_NAMES[m])
         elif filter_mode == "Custom":
             start_date = f2.date_input("Da", min_date)
             end_date = f3.date_input("A", max_date)
-            if start_date <= end_date:
-                filtered_df = df[(df['date'].dt.date >= start_date) & (df['date'].dt.date <= end_date)]
-            else:
+            if start_date > end_date:
                 st.error("La data iniziale deve precedere quella finale.")
 
         # Filtro conto
         all_accounts = sorted(df['account'].dropna().unique().tolist())
         account_filter = f4.multiselect("Conti", options=all_accounts, placeholder="Tutti i conti")
-        if account_filter:
-            filtered_df = filtered_df[filtered_df['account'].isin(account_filter)]
+
+        view_key = (data_manager.db_path, data_manager.data_version, filter_mode,
+                    selected_year, selected_month, start_date, end_date, tuple(account_filter))
+        views = _filter_views(df, view_key)
+        filtered_df = views['filtered']
 
         # --- Riepilogo del mese + Calendario (solo modalità Mese) ---
         if filter_mode == "Month" and selected_year and selected_month:
@@ -81,10 +474,10 @@ def render_dashboard(data_manager):
             # Mese precedente (per il delta)
             pm = selected_month - 1 if selected_month > 1 else 12
             py = selected_year if selected_month > 1 else selected_year - 1
-            p_exp = real_expenses(df[(df['year'] == py) & (df['month'] == pm)])['amount'].abs().sum()
+            p_exp = real_expenses(_date_slice(df, *_month_bounds(py, pm)))['amount'].abs().sum()
             delta_exp = m_exp - p_exp
 
-            month_lbl = f"{month_names[selected_month]} {selected_year}"
+            month_lbl = f"{MONTH_NAMES[selected_month]} {selected_year}"
             st.subheader(f"📋 Riepilogo {month_lbl}")
             r1, r2, r3, r4 = st.columns(4)
             r1.metric("Speso", f"€{m_exp:,.0f}",
@@ -96,15 +489,14 @@ def render_dashboard(data_manager):
 
             # Riga narrativa: categoria top, spesa più grande, stato budget
             bits = []
-            mm = m_exp_df.copy()
+            mm = m_exp_df
             if not mm.empty:
-                mm['abs'] = mm['amount'].abs()
-                byc = mm.groupby('category')['abs'].sum().sort_values(ascending=False)
+                byc = mm.groupby('category', observed=True, sort=False)['abs_amount'].sum().sort_values(ascending=False)
                 if not byc.empty:
                     bits.append(f"Categoria top: **{byc.index[0]}** (€{byc.iloc[0]:,.0f})")
-                big = mm.sort_values('abs', ascending=False).iloc[0]
+                big = mm.nlargest(1, 'abs_amount').iloc[0]
                 bits.append(f"Spesa più grande: **€{abs(big['amount']):,.0f}** ({big['category']})")
-                budgets = re.rules.get('budgets', {})
+                budgets = rules_engine.rules.get('budgets', {})
                 if budgets:
                     over = sum(1 for c, b in budgets.items() if b and byc.get(c, 0) > b)
                     bits.append(f"⚠️ **{over}** categorie oltre budget" if over else "✅ Budget rispettati")
@@ -113,113 +505,56 @@ def render_dashboard(data_manager):
 
             # Calendario spese del mese (heatmap giornaliera)
             if not mm.empty:
-                day_exp = mm.groupby(mm['date'].dt.day)['abs'].sum()
-                weeks = calendar.Calendar(firstweekday=0).monthdayscalendar(selected_year, selected_month)
-                z, txt = [], []
-                for wk in weeks:
-                    zr, tr = [], []
-                    for d in wk:
-                        if d == 0:
-                            zr.append(None); tr.append("")
-                        else:
-                            v = float(day_exp.get(d, 0) or 0)
-                            zr.append(v)
-                            tr.append(f"<b>{d}</b><br>€{v:,.0f}" if v > 0 else f"{d}")
-                    z.append(zr); txt.append(tr)
-                x_lbl = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
-                y_lbl = [f"S{i+1}" for i in range(len(weeks))]
-                fig_cal = go.Figure(go.Heatmap(
-                    z=z, text=txt, texttemplate="%{text}", hoverinfo='text',
-                    x=x_lbl, y=y_lbl, colorscale='Oranges', showscale=False, xgap=3, ygap=3))
-                fig_cal.update_yaxes(autorange='reversed', showticklabels=False)
-                fig_cal.update_layout(height=70 + len(weeks) * 60,
-                                      margin=dict(l=6, r=6, t=6, b=6))
-                with st.expander("📅 Calendario spese del mese", expanded=False):
-                    st.plotly_chart(fig_cal, use_container_width=True, key="cal_heat")
-                    # Drill-down per giorno (selettore affidabile: il click sulla heatmap
-                    # non è supportato in modo affidabile da Streamlit)
-                    days_with = [int(d) for d in sorted(day_exp[day_exp > 0].index.tolist())]
-                    if days_with:
-                        day_opts = ["—"] + [f"{d} {month_names[selected_month]} · €{day_exp.get(d, 0):,.0f}"
-                                            for d in days_with]
-                        sel_day_lbl = st.selectbox("👉 Vedi le spese di un giorno", day_opts, key="cal_day_sel")
-                        if sel_day_lbl != "—":
-                            dnum = int(sel_day_lbl.split()[0])
-                            day_tx = filtered_df[filtered_df['date'].dt.day == dnum]
-                            st.markdown(f"**Transazioni del {dnum} {month_names[selected_month]}** — "
-                                        f"€{day_exp.get(dnum, 0):,.2f}")
-                            st.dataframe(day_tx[['date', 'description', 'category', 'amount', 'tags']]
-                                         .sort_values('date'), hide_index=True, use_container_width=True)
+                _render_month_calendar(mm, filtered_df, selected_year, selected_month)
 
         # --- 0. Liquidity Overview (New) ---
         st.divider()
         st.subheader("💳 Wallet & Liquidity")
         
-        # We must operate on the FULL dataset for liquidity (cumulative balance)
-        full_df = df # df is already full get_transactions() result
+        # Liquidità sull'intero dataset (df non è mai vuoto qui: uscita anticipata sopra)
+        # Calculate balance per account
+        balances = _wallet_balances(df, data_manager.db_path, data_manager.data_version)
+        total_liquidity = balances['amount'].sum()
         
-
-        if not full_df.empty:
-            # Calculate balance per account
-            balances = full_df.groupby('account')['amount'].sum().reset_index()
-            total_liquidity = balances['amount'].sum()
-            
-            # --- Total Liquidity Big Card ---
-            st.markdown(f"""
-            <div style="padding: 20px; border-radius: 10px; background: linear-gradient(90deg, #4CAF50 0%, #2E7D32 100%); color: white; margin-bottom: 20px; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
-                <h3 style="margin:0; font-size: 1.2rem; opacity: 0.9;">Total Liquidity</h3>
-                <h1 style="margin:0; font-size: 2.5rem;">€ {total_liquidity:,.2f}</h1>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # --- Wallet Grid ---
-            if not balances.empty:
-                st.write("##### Active Wallets")
-
-                # Main wallet first, then by balance descending
-                balances['_is_main'] = balances['account'] == main_wallet
-                balances = balances.sort_values(
-                    ['_is_main', 'amount'], ascending=[False, False]
-                ).reset_index(drop=True)
-
-                # Helper for icons
-                def get_icon(name):
-                    # Check custom rule first
-                    if name in wallet_rules and 'icon' in wallet_rules[name]:
-                        return wallet_rules[name]['icon']
-                        
-                    name = name.lower()
-                    if any(x in name for x in ['contanti', 'cash', 'tasca']): return "💵"
-                    if any(x in name for x in ['banca', 'bank', 'unicredit', 'intesa', 'bnl', 'posta', 'conto']): return "🏦"
-                    if any(x in name for x in ['revolut', 'paypal', 'satispay', 'visa', 'mastercard', 'amex']): return "💳"
-                    if any(x in name for x in ['risparmi', 'fondo', 'deposito', 'salvadanaio']): return "🐷"
-                    if any(x in name for x in ['invest', 'trade', 'crypto', 'bitcoin']): return "📈"
-                    return "👛"
-
-                # Create rows of 3
-                cols = st.columns(3)
-                for i, row in balances.iterrows():
-                    acc_name = row['account']
-                    bal = row['amount']
-                    icon = get_icon(acc_name)
-                    
-                    # Determine color for amount
-                    color = "#2E7D32" if bal >= 0 else "#C62828"
-                    
-                    is_main = acc_name == main_wallet
-
-                    with cols[i % 3]:
-                        with st.container(border=True):
-                            title = f"**{icon} {acc_name}**"
-                            if is_main:
-                                title += " &nbsp;<span style='background:#FFF3E0;color:#E65100;border-radius:4px;padding:1px 6px;font-size:0.7em;font-weight:700;'>⭐ PRINCIPALE</span>"
-                            st.markdown(title, unsafe_allow_html=True)
-                            st.markdown(f"<h3 style='margin:0; color: {color};'>€ {bal:,.2f}</h3>", unsafe_allow_html=True)
+        # --- Total Liquidity Big Card ---
+        st.markdown(f"""
+        <div style="padding: 20px; border-radius: 10px; background: linear-gradient(90deg, #4CAF50 0%, #2E7D32 100%); color: white; margin-bottom: 20px; box-shadow: 0 4px 6px rgba(0,0,0,0.1);">
+            <h3 style="margin:0; font-size: 1.2rem; opacity: 0.9;">Total Liquidity</h3>
+            <h1 style="margin:0; font-size: 2.5rem;">€ {total_liquidity:,.2f}</h1>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        # --- Wallet Grid ---
+        if not balances.empty:
+            st.write("##### Active Wallets")
+
+            # Main wallet first, then by balance descending
+            balances['_is_main'] = balances['account'] == main_wallet
+            balances = balances.sort_values(
+                ['_is_main', 'amount'], ascending=[False, False]
+            ).reset_index(drop=True)
+
+            # Griglia 3 colonne in un unico blocco HTML (un solo messaggio invece di 3 per wallet);
+            # lo stile sta nel <style> di WALLET_CARD_CSS, le card portano solo classi
+            badge = "&nbsp;<span class='wallet-badge'>⭐ PRINCIPALE</span>"
+            cards = [
+                f"<div class='wallet-card'>"
+                f"<div class='wallet-name'>{icon} {acc}{badge if acc == main_wallet else ''}</div>"
+                f"<h3 class='wallet-bal {'pos' if bal >= 0 else 'neg'}'>€ {bal:,.2f}</h3>"
+                f"</div>"
+                for acc, bal, icon in zip(balances['account'], balances['amount'],
+                                          _wallet_icons(balances['account'], wallet_rules))
+            ]
+            st.markdown(
+                WALLET_CARD_CSS + "<div class='wallet-grid'>" + "".join(cards) + "</div>",
+                unsafe_allow_html=True
+            )
 
         # --- Metrics ---
         st.divider()
-        total_income = filtered_df[filtered_df['type'] == 'Income']['amount'].sum()
-        total_expense = filtered_df[filtered_df['type'] == 'Expense']['amount'].sum()
+        # Riduzioni su colonne già azzerate fuori tipo: nessuna maschera né copia per rerun
+        total_income = filtered_df['income_amt'].sum()
+        total_expense = filtered_df['expense_amt'].sum()
         balance = total_income + total_expense
         savings_rate = (balance / total_income * 100) if total_income > 0 else 0
 
@@ -228,13 +563,12 @@ def render_dashboard(data_manager):
         projected_balance = balance
         
         if filter_mode == "Month":
-            from datetime import date
             # Calculate end of selected month
             last_day = calendar.monthrange(selected_year, selected_month)[1]
             end_of_period = date(selected_year, selected_month, last_day)
             
             # Get projections up to end of month
-            proj_df = data_manager.get_projected_recurring(end_of_period)
+            proj_df = _projected_recurring(data_manager, end_of_period, data_manager.db_path, data_manager.data_version)
             
             if not proj_df.empty:
                 # Sum expenses (negative amounts)
@@ -250,7 +584,7 @@ def render_dashboard(data_manager):
 
         # --- Recurring Expenses Impact ---
         # Get monthly recurring total
-        rec_df = data_manager.get_recurring()
+        rec_df = data_manager.get_recurring(cols=['amount', 'frequency'])
         total_recurring_monthly = 0.0
         
         if not rec_df.empty:
@@ -285,11 +619,11 @@ def render_dashboard(data_manager):
         if filter_mode == "Month" and selected_year is not None and selected_month is not None:
             prev_m = selected_month - 1 if selected_month > 1 else 12
             prev_y = selected_year if selected_month > 1 else selected_year - 1
-            prev_df = df[(df['year'] == prev_y) & (df['month'] == prev_m)]
+            prev_df = _date_slice(df, *_month_bounds(prev_y, prev_m))
             if account_filter:
                 prev_df = prev_df[prev_df['account'].isin(account_filter)]
-            prev_income = prev_df[prev_df['type'] == 'Income']['amount'].sum()
-            prev_expense = prev_df[prev_df['type'] == 'Expense']['amount'].sum()
+            prev_income = prev_df['income_amt'].sum()
+            prev_expense = prev_df['expense_amt'].sum()
             prev_balance = prev_income + prev_expense
             if prev_income != 0:
                 diff_inc = total_income - prev_income
@@ -330,13 +664,12 @@ def render_dashboard(data_manager):
              
              # Calculate Pending Recurring for this month
              # We already have `projected_msg` logic earlier, let's reuse/refine.
-             from datetime import date
              last_day = calendar.monthrange(selected_year, selected_month)[1]
              end_of_period = date(selected_year, selected_month, last_day)
              
              # Get projections up to end of month
              # Note: get_projected_recurring returns negative amounts for expenses
-             proj_df = data_manager.get_projected_recurring(end_of_period)
+             proj_df = _projected_recurring(data_manager, end_of_period, data_manager.db_path, data_manager.data_version)
              pending_recurring = 0.0
              if not proj_df.empty:
                  pending_recurring = proj_df[proj_df['amount'] < 0]['amount'].sum()
@@ -375,95 +708,14 @@ def render_dashboard(data_manager):
         # --- Visualizations ---
         
         # 1. Income vs Expense Breakdown
+        expense_df = views['expense']
         col_charts_1, col_charts_2 = st.columns(2)
         
         with col_charts_1:
-            st.subheader("Income Sources")
-            income_df = filtered_df[filtered_df['type'] == 'Income']
-            if not income_df.empty:
-                income_by_cat = income_df.groupby('category')['amount'].sum().reset_index()
-                fig_inc = px.pie(income_by_cat, values='amount', names='category', hole=0.4)
-                inc_event = st.plotly_chart(fig_inc, use_container_width=True, on_select="rerun", key="pie_income")
-                # Drill-down
-                if inc_event and inc_event.selection and inc_event.selection.points:
-                    sel_cat = inc_event.selection.points[0].get('label')
-                    if sel_cat:
-                        st.markdown(f"**Transactions — {sel_cat}**")
-                        drill = income_df[income_df['category'] == sel_cat][['date','description','amount','tags']].sort_values('date', ascending=False)
-                        st.dataframe(drill, use_container_width=True, hide_index=True)
-            else:
-                st.info("No income data for this period.")
+            _render_income_breakdown(views['income'])
 
         with col_charts_2:
-            st.subheader("Spese per Categoria")
-            expense_df = filtered_df[filtered_df['type'] == 'Expense']
-            if not expense_df.empty:
-                expense_df = expense_df.copy()
-                expense_df['abs_amount'] = expense_df['amount'].abs()
-                exp_total = expense_df['abs_amount'].sum()
-                exp_by_cat = expense_df.groupby('category')['abs_amount'].sum().reset_index().sort_values('abs_amount', ascending=False)
-                fig_exp = px.pie(exp_by_cat, values='abs_amount', names='category', hole=0.4)
-                exp_event = st.plotly_chart(fig_exp, use_container_width=True, on_select="rerun", key="pie_expense")
-                st.caption("👆 Clicca una categoria (torta o tabella) per il dettaglio per tag.")
-
-                # Tabella categorie (importo + %) — sempre visibile
-                cat_show = exp_by_cat.copy()
-                cat_show['%'] = (cat_show['abs_amount'] / exp_total * 100).apply(lambda x: f"{x:.1f}%")
-                cat_show['Importo'] = exp_by_cat['abs_amount'].apply(lambda x: f"€{x:,.2f}")
-                cat_sel_event = st.dataframe(
-                    cat_show[['category', 'Importo', '%']],
-                    use_container_width=True, hide_index=True,
-                    on_select="rerun", selection_mode="single-row", key="cat_table",
-                    column_config={"category": "Categoria"}
-                )
-
-                # Categoria selezionata: dalla torta o dalla riga della tabella
-                sel_cat = None
-                if exp_event and exp_event.selection and exp_event.selection.points:
-                    sel_cat = exp_event.selection.points[0].get('label')
-                elif cat_sel_event and cat_sel_event.selection and cat_sel_event.selection.rows:
-                    sel_cat = exp_by_cat.iloc[cat_sel_event.selection.rows[0]]['category']
-
-                if sel_cat:
-                    cat_data = expense_df[expense_df['category'] == sel_cat]
-                    cat_total = cat_data['abs_amount'].sum()
-                    st.markdown(f"#### 📂 {sel_cat} — €{cat_total:,.2f} ({cat_total/exp_total*100:.0f}% del mese)")
-
-                    # Sotto-ripartizione per tag (sottocategorie)
-                    tag_expl = cat_data.explode('tags')
-                    tag_expl['tags'] = tag_expl['tags'].astype(str)
-                    tag_expl = tag_expl[~tag_expl['tags'].isin(['nan', 'None', ''])]
-                    if not tag_expl.empty:
-                        tag_break = tag_expl.groupby('tags')['abs_amount'].sum().reset_index().sort_values('abs_amount', ascending=False)
-                        tag_break['%'] = tag_break['abs_amount'] / cat_total * 100
-                        th = tag_break.head(12).copy()
-                        th['lbl'] = th['%'].apply(lambda x: f"{x:.0f}%")
-                        fig_tb = px.bar(th, x='tags', y='abs_amount', text='lbl',
-                                        title=f"Per tag — {sel_cat}")
-                        fig_tb.update_layout(height=280, showlegend=False, xaxis_title='', yaxis_title='€')
-                        st.plotly_chart(fig_tb, use_container_width=True)
-
-                        tb_show = tag_break.copy()
-                        tb_show['Importo'] = tb_show['abs_amount'].apply(lambda x: f"€{x:,.2f}")
-                        tb_show['%'] = tb_show['%'].apply(lambda x: f"{x:.1f}%")
-                        st.dataframe(tb_show[['tags', 'Importo', '%']], use_container_width=True,
-                                     hide_index=True, column_config={"tags": "Tag"})
-
-                        def _has_tags(t):
-                            if hasattr(t, 'tolist'):
-                                t = t.tolist()
-                            return isinstance(t, list) and any(x and str(x) not in ('nan', 'None') for x in t)
-                        untag = cat_data[~cat_data['tags'].apply(_has_tags)]['abs_amount'].sum()
-                        if untag > 0:
-                            st.caption(f"Senza tag: €{untag:,.2f} ({untag/cat_total*100:.0f}%)")
-                    else:
-                        st.caption("Nessun tag in questa categoria.")
-
-                    st.markdown("**Transazioni**")
-                    drill = cat_data[['date', 'description', 'amount', 'tags']].sort_values('date', ascending=False)
-                    st.dataframe(drill, use_container_width=True, hide_index=True)
-            else:
-                st.info("No expense data for this period.")
+            _render_expense_breakdown(expense_df)
 
         # (Confronto Anno vs Anno spostato nella pagina 📊 Analysis → Anno vs Anno)
 
@@ -485,7 +737,6 @@ def render_dashboard(data_manager):
         # If in "Month" view, let's show Daily trend for that month instead?
         # User asked: "grafico del saldo mese per mese che ora manca". This implies a Year/AllTime view.
         
-        chart_data = filtered_df.copy()
         if filter_mode == "Month":
              # In Month mode, showing "Month by Month" is one bar. 
              # Let's switch to show the whole Year of the selected month to give context?
@@ -500,36 +751,31 @@ def render_dashboard(data_manager):
             st.caption("Daily Trend for selected month")
             try:
                 # Use pivot_table for safety
-                daily_df = filtered_df.copy()
-                daily_df['day_date'] = daily_df['date'].dt.date
+                # Solo le colonne che servono al pivot, niente copia dell'intero frame
+                # Floor al giorno restando in datetime64 (niente oggetti date Python nella chiave)
+                daily_df = filtered_df[['income_amt', 'expense_amt']].assign(
+                    day_date=filtered_df['date'].dt.normalize())
                 
                 if not daily_df.empty:
-                    grp = daily_df.pivot_table(index='day_date', columns='type', values='amount', aggfunc='sum', fill_value=0)
-                    
-                    if 'Income' not in grp.columns: grp['Income'] = 0.0
-                    if 'Expense' not in grp.columns: grp['Expense'] = 0.0
-                    
-                    grp['Balance'] = grp['Income'] + grp['Expense']
-                    grp['Cumulative'] = grp['Balance'].cumsum()
-                    
-                    daily_stats = grp.reset_index()
-                    # daily_stats has 'day_date' as column now
+                    daily_stats = _cashflow_pivot(daily_df, 'day_date')
+                    daily_stats['Cumulative'] = daily_stats['Balance'].cumsum()
                     
                     if not daily_stats.empty:
-                        fig_daily = go.Figure()
-                        
-                        fig_daily.add_trace(go.Bar(x=daily_stats['day_date'], y=daily_stats['Income'], name='Daily Income', marker_color='#4CAF50', opacity=0.6))
-                        fig_daily.add_trace(go.Bar(x=daily_stats['day_date'], y=daily_stats['Expense'], name='Daily Expenses', marker_color='#EF5350', opacity=0.6))
-                        
-                        fig_daily.add_trace(go.Scatter(x=daily_stats['day_date'], y=daily_stats['Cumulative'], name='Month Cashflow', mode='lines+markers', line=dict(color='#2196F3', width=3)))
-                        
-                        fig_daily.update_layout(
-                            title="Daily Cashflow & Trend",
-                            barmode='overlay',
-                            xaxis_title="Date",
-                            yaxis_title="Amount (€)",
-                            hovermode="x unified",
-                            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+                        fig_daily = go.Figure(
+                            data=[
+                                go.Bar(x=daily_stats['day_date'], y=daily_stats['Income'], name='Daily Income', marker_color='#4CAF50', opacity=0.6),
+                                go.Bar(x=daily_stats['day_date'], y=daily_stats['Expense'], name='Daily Expenses', marker_color='#EF5350', opacity=0.6),
+                                go.Scatter(x=daily_stats['day_date'], y=daily_stats['Cumulative'], name='Month Cashflow', mode='lines+markers', line=dict(color='#2196F3', width=3)),
+                            ],
+                            layout=go.Layout(
+                                title="Daily Cashflow & Trend",
+                                barmode='overlay',
+                                xaxis_title="Date",
+                                yaxis_title="Amount (€)",
+                                hovermode="x unified",
+                                uirevision='dashboard',
+                                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+                            )
                         )
                         st.plotly_chart(fig_daily, use_container_width=True)
                     else:
@@ -542,28 +788,17 @@ def render_dashboard(data_manager):
         if filter_mode != "Month": 
             # Group by Month-Year
             try:
-                trend_df = filtered_df.copy()
-                trend_df['month_date'] = trend_df['date'].apply(lambda d: d.replace(day=1))
+                trend_df = filtered_df[['income_amt', 'expense_amt', 'month_date']]
                 
                 if not trend_df.empty:
-                    # Safe Pivot
-                    grp = trend_df.pivot_table(index='month_date', columns='type', values='amount', aggfunc='sum', fill_value=0)
-                    
-                    if 'Income' not in grp.columns: grp['Income'] = 0.0
-                    if 'Expense' not in grp.columns: grp['Expense'] = 0.0
-                    
-                    grp['Balance'] = grp['Income'] + grp['Expense']
-                    
-                    monthly_stats = grp.reset_index()
+                    monthly_stats = _cashflow_pivot(trend_df, 'month_date')
                     
                     if not monthly_stats.empty:
                         st.subheader("Monthly Balance Trend")
-                        fig_combo = go.Figure()
-                        fig_combo.add_trace(go.Bar(x=monthly_stats['month_date'], y=monthly_stats['Income'], name='Income', marker_color='#4CAF50'))
-                        fig_combo.add_trace(go.Bar(x=monthly_stats['month_date'], y=monthly_stats['Expense'], name='Expenses', marker_color='#EF5350'))
-                        fig_combo.add_trace(go.Scatter(x=monthly_stats['month_date'], y=monthly_stats['Balance'], name='Net Balance', mode='lines+markers', line=dict(color='#2196F3', width=3), marker=dict(size=8)))
-                        
-                        fig_combo.update_layout(title="Monthly Income, Expenses & Balance", barmode='overlay', xaxis_title="Month", yaxis_title="Amount (€)", legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1), hovermode="x unified")
+                        fig_combo = _cashflow_figure(
+                            monthly_stats, 'month_date', "Monthly Income, Expenses & Balance",
+                            xaxis_title="Month", yaxis_title="Amount (€)",
+                            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
                         st.plotly_chart(fig_combo, use_container_width=True)
                     else:
                         st.info("No data for trend.")
@@ -575,23 +810,28 @@ def render_dashboard(data_manager):
             # Net Worth Chart
             st.subheader("📈 Total Net Worth Evolution")
             try:
-                nw_df = df.sort_values('date').copy()
-                nw_df['cumulative_balance'] = nw_df['amount'].cumsum()
+                nw_df = _networth_daily(df, data_manager.db_path, data_manager.data_version)
                 
                 if filter_mode == "Year":
-                     start_of_year = pd.Timestamp(selected_year, 1, 1).date()
-                     end_of_year = pd.Timestamp(selected_year, 12, 31).date()
-                     chart_nw = nw_df[(nw_df['date'].dt.date >= start_of_year) & (nw_df['date'].dt.date <= end_of_year)]
+                     chart_nw = _date_slice(nw_df, *_year_bounds(selected_year))
                 elif filter_mode == "Custom":
-                     chart_nw = nw_df[(nw_df['date'].dt.date >= start_date) & (nw_df['date'].dt.date <= end_date)]
+                     chart_nw = _date_slice(nw_df, pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1))
                 else: 
                      chart_nw = nw_df
                 
                 if not chart_nw.empty:
-                    daily_nw = chart_nw.groupby('date')['cumulative_balance'].last().reset_index()
-                    fig_nw = px.area(daily_nw, x='date', y='cumulative_balance', title="Total Net Worth Over Time", labels={'cumulative_balance': 'Net Worth (€)'})
-                    fig_nw.update_layout(hovermode="x unified")
-                    fig_nw.update_traces(line_color='#009688', fillcolor='rgba(0, 150, 136, 0.3)')
+                    # Serie lunghe (anni di storico giornaliero): LTTB a ~1500 punti + WebGL
+                    if len(chart_nw) > 2000:
+                        keep = _lttb_indices(chart_nw['date'].to_numpy().astype('datetime64[ns]').astype(np.int64),
+                                             chart_nw['cumulative_balance'].to_numpy(), 1500)
+                        chart_nw = chart_nw.iloc[keep]
+                    fig_nw = go.Figure(
+                        data=[go.Scattergl(
+                            x=chart_nw['date'], y=chart_nw['cumulative_balance'], mode='lines', fill='tozeroy',
+                            name='Net Worth (€)', line=dict(color='#009688'), fillcolor='rgba(0, 150, 136, 0.3)')],
+                        layout=go.Layout(title="Total Net Worth Over Time", xaxis_title="date",
+                                         yaxis_title="Net Worth (€)", hovermode="x unified",
+                                         uirevision='dashboard'))
                     st.plotly_chart(fig_nw, use_container_width=True)
             except Exception as e:
                 st.error(f"Error calculating net worth: {e}")
@@ -600,26 +840,14 @@ def render_dashboard(data_manager):
              # Yearly Context in Month Mode
              st.subheader("Yearly Context")
              try:
-                 year_df = df[df['year'] == selected_year].copy()
-                 year_df['month_date'] = year_df['date'].apply(lambda d: d.replace(day=1))
+                 year_df = _date_slice(df, *_year_bounds(selected_year))[['income_amt', 'expense_amt', 'month_date']]
                  
                  if not year_df.empty:
-                     grp = year_df.pivot_table(index='month_date', columns='type', values='amount', aggfunc='sum', fill_value=0)
-                     
-                     if 'Income' not in grp.columns: grp['Income'] = 0.0
-                     if 'Expense' not in grp.columns: grp['Expense'] = 0.0
-                     
-                     grp['Balance'] = grp['Income'] + grp['Expense']
-                     
-                     monthly_stats = grp.reset_index()
+                     monthly_stats = _cashflow_pivot(year_df, 'month_date')
                      
                      if not monthly_stats.empty:
-                         fig_combo = go.Figure()
-                         fig_combo.add_trace(go.Bar(x=monthly_stats['month_date'], y=monthly_stats['Income'], name='Income', marker_color='#4CAF50'))
-                         fig_combo.add_trace(go.Bar(x=monthly_stats['month_date'], y=monthly_stats['Expense'], name='Expenses', marker_color='#EF5350'))
-                         fig_combo.add_trace(go.Scatter(x=monthly_stats['month_date'], y=monthly_stats['Balance'], name='Net Balance', mode='lines+markers', line=dict(color='#2196F3', width=3)))
-                         
-                         fig_combo.update_layout(title=f"Overview {selected_year}", barmode='relative', hovermode="x unified")
+                         fig_combo = _cashflow_figure(monthly_stats, 'month_date', f"Overview {selected_year}",
+                                                      barmode='relative')
                          st.plotly_chart(fig_combo, use_container_width=True)
                  else:
                      st.info("No data for yearly context.")
@@ -629,7 +857,7 @@ def render_dashboard(data_manager):
         st.divider()
 
         # Budget Progress Bars
-        budgets = re.rules.get('budgets', {})
+        budgets = rules_engine.rules.get('budgets', {})
         if budgets and not expense_df.empty:
             st.subheader("🎯 Budget Progress")
             budget_cols = st.columns(min(len(budgets), 3))
@@ -646,27 +874,29 @@ def render_dashboard(data_manager):
 
         # Top Transactions (le ripartizioni per categoria/tag sono gia' nei grafici a
         # torta sopra, con drill-down, e nella tab Analysis -> Categorie)
-        expense_df = filtered_df[filtered_df['type'] == 'Expense'].copy()
-        if not expense_df.empty:
-            expense_df['abs_amount'] = expense_df['amount'].abs()
-
         st.subheader("🏆 Top Transactions")
         # Show top 10 largest expenses
         if not expense_df.empty:
-            top_expenses = expense_df.sort_values('abs_amount', ascending=False).head(10)
+            top_expenses = expense_df.nlargest(10, 'abs_amount', keep='first')
             
             display_cols = top_expenses[['date', 'description', 'category', 'tags', 'amount']]
             st.dataframe(
-                display_cols.style.format({'amount': '€{:.2f}'}), 
-                use_container_width=True, 
-                hide_index=True
+                display_cols,
+                use_container_width=True,
+                hide_index=True,
+                column_config={"amount": st.column_config.NumberColumn("amount", format="€%.2f")}
             )
         else:
             st.info("No transactions.")
 
         # 4. Detailed Transaction List (Optional toggle)
+        # Il corpo di un expander gira (e viene serializzato) anche da chiuso: la tabella
+        # completa si carica solo su richiesta.
         with st.expander("View All Transactions in this Period"):
-            st.dataframe(filtered_df.sort_values('date', ascending=False), use_container_width=True)
+            if st.toggle(f"Mostra {len(filtered_df):,} transazioni", key="show_all_tx"):
+                # filtered_df è già ordinato per data: basta invertirlo, niente sort
+                st.dataframe(filtered_df.drop(columns=DERIVED_COLS).iloc[::-1],
+                             use_container_width=True)
 
     except Exception as e:
         st.error(f"Error loading dashboard: {e}")
@@ -1,12 +1,152 @@
 import streamlit as st
 import os
+import io
+import hashlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import numpy as np
 import json
 from src.data_manager import DataManager
-from src.pdf_parser import PDFParser
-from src.ocr_engine import OCREngine
 from src.ui.styling import get_chart_colors
 
+# orjson (opzionale) per la coda di revisione: encode/decode in C, fallback su json
+try:
+    import orjson
+
+    def _json_line(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_line(obj):
+        return (json.dumps(obj) + "\n").encode()
+
+    _json_loads = json.loads
+
+
+@st.cache_data(show_spinner="Scanning document...", max_entries=16)
+def _parse_bill(digest, _raw):
+    """
+    Parsing della bolletta memoizzato sul contenuto del PDF (non sul nome del file):
+    la chiave è l'md5 dei byte, `_raw` non viene hashato da Streamlit.
+    """
+    # import locale: pdfplumber viene caricato solo quando si scansiona una bolletta
+    from src.pdf_parser import PDFParser
+    return PDFParser().extract_bill_data(io.BytesIO(_raw))
+
+
+@st.cache_resource(show_spinner=False)
+def _get_ocr():
+    """OCREngine unico per processo: il modello EasyOCR si carica una volta sola."""
+    from src.ocr_engine import OCREngine
+    return OCREngine()
+
+
+# Coda di revisione in JSONL append-only: una riga per transazione ({"_id": ..., ...})
+# e una riga {"_drop": id} per ogni conferma/scarto. Si ricompatta solo quando
+# le righe morte superano la metà del file.
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_pending(path, mtime):
+    """
+    Coda di revisione letta dal disco solo quando il file cambia (mtime nella chiave).
+    Returns: (transazioni vive in ordine di arrivo, numero di righe morte)
+    """
+    items, n_lines = {}, 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                n_lines += 1
+                try:
+                    rec = _json_loads(line)
+                except ValueError:
+                    continue
+                if '_drop' in rec:
+                    items.pop(rec['_drop'], None)
+                elif '_id' in rec:
+                    items[rec['_id']] = rec
+    except OSError:
+        pass
+    return list(items.values()), n_lines - len(items)
+
+
+def _pending_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+
+def _append_pending(path, txs):
+    """Accoda le nuove transazioni (O(len(txs)), il resto del file non viene riscritto)."""
+    with open(path, 'ab') as f:
+        f.writelines(_json_line({'_id': uuid.uuid4().hex, **tx}) for tx in txs)
+    _load_pending.clear()
+
+
+def _drop_pending(path, ids, live, dead):
+    """Scrive i tombstone per `ids`; ricompatta se le righe morte superano il 50%."""
+    ids = set(ids)
+    dead += 2 * len(ids)
+    remaining = [tx for tx in live if tx['_id'] not in ids]
+    if dead > len(remaining):
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.writelines(_json_line(tx) for tx in remaining)
+        os.replace(tmp, path)
+    else:
+        with open(path, 'ab') as f:
+            f.writelines(_json_line({'_drop': i}) for i in ids)
+    _load_pending.clear()
+
+
+def _migrate_legacy_pending(legacy_path, path):
+    """Converte una volta la vecchia coda pending_transactions.json nel formato JSONL."""
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return
+    try:
+        with open(legacy_path, 'rb') as f:
+            legacy = _json_loads(f.read())
+    except (OSError, ValueError):
+        return
+    _append_pending(path, legacy)
+    os.remove(legacy_path)
+
+
+@st.cache_resource(show_spinner=False)
+def _ocr_executor():
+    """Worker per l'OCR: uno solo, l'OCREngine condiviso serializza comunque readtext."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr")
+
+
+@st.fragment(run_every=1)
+def _ocr_job_status(pending_file):
+    """
+    Controlla ogni secondo il job OCR in corso (solo il fragment si riesegue).
+    A job concluso salva l'esito e rilancia l'app, che smette di chiamare il poller.
+    """
+    fut = st.session_state.get('ocr_future')
+    if fut is None:
+        return
+    if not fut.done():
+        st.status("⏳ Reading text from image... (first run downloads models ~100MB)", state="running")
+        return
+
+    del st.session_state['ocr_future']
+    try:
+        results, raw_text = fut.result()
+    except Exception as e:
+        import traceback
+        st.session_state.ocr_outcome = ('error', (e, "".join(traceback.format_exception(e))))
+        st.rerun()
+
+    if results:
+        _append_pending(pending_file, results)
+        st.toast(f"Found {len(results)} transactions, added to Review Queue!", icon="🚀")
+    else:
+        st.session_state.ocr_outcome = ('empty', raw_text)
+    st.rerun()
+
+
 def render_importer(data_manager: DataManager):
     st.header("Import Data")
     
@@ -14,14 +154,9 @@ def render_importer(data_manager: DataManager):
     db_path = os.environ.get('DB_PATH', 'finance_data/finance.duckdb')
     data_dir = os.path.dirname(db_path) or 'finance_data'
     os.makedirs(data_dir, exist_ok=True)
-    pending_file = os.path.join(data_dir, "pending_transactions.json")
-    pending_data = []
-    if os.path.exists(pending_file):
-        try:
-            with open(pending_file, 'r') as f:
-                pending_data = json.load(f)
-        except:
-            pass
+    pending_file = os.path.join(data_dir, "pending_transactions.jsonl")
+    _migrate_legacy_pending(os.path.join(data_dir, "pending_transactions.json"), pending_file)
+    pending_data, pending_dead = _load_pending(pending_file, _pending_mtime(pending_file))
 
     # Tabs
     tab_names = ["📂 Bulk Import (ZIP)", "📄 Scan Bill (PDF)", "📷 Screenshot Import"]
@@ -38,90 +173,81 @@ def render_importer(data_manager: DataManager):
             st.subheader(f"⚠️ Pending Review ({len(pending_data)} items)")
             st.info("These transactions were detected from screenshots/chats. Please review and confirm them.")
             
-            # Wizard style: Show one at a time or list? 
-            # List is better for overview, but wizard ensures quality.
-            # Let's do an Expander for each, open the first one by default?
-            # Or a "Process Next" flow.
-            
-            # Let's show a table of all, and an editor for the "Current" one (first in list)
-            
-            if not pending_data:
-                st.success("All caught up!")
-            else:
-                # Current item to review (always index 0)
-                current_tx = pending_data[0]
-                
-                with st.container(border=True):
-                    st.markdown(f"### Reviewing: **{current_tx.get('description')}**")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        p_date = st.date_input("Date", pd.to_datetime(current_tx.get('date')).date())
-                        p_amount = st.number_input("Amount", value=float(current_tx.get('amount')), step=0.01)
-                        p_type = "Expense" if p_amount < 0 else "Income"
-                        
-                    with col2:
-                        # Category
-                        cats = data_manager.get_unique_categories() + ["New..."]
-                        # Try to guess category from history or rules
-                        suggested_cat = "General"
-                        if hasattr(data_manager, 'rules_engine'):
-                             # Quick check history
-                             pass 
-                        
-                        p_cat = st.selectbox("Category", cats, index=0)
-                        if p_cat == "New...":
-                            p_cat = st.text_input("New Category Name")
-                            
-                        # Wallet
-                        accounts = data_manager.get_unique_accounts()
-                        p_account = st.selectbox("Wallet / Account", accounts if accounts else ["Cash"])
-                        
-                    # Tags
-                    p_tags_str = st.text_input("Tags (comma separated)", value="")
-                    
-                    p_nec = st.radio("Necessity", ["Need", "Want"], horizontal=True)
-                    
-                    col_b1, col_b2 = st.columns([1, 1])
-                    if col_b1.button("✅ Confirm & Add", type="primary", use_container_width=True):
-                         # Add to DB
-                         final_tags = [t.strip() for t in p_tags_str.split(',') if t.strip()]
-                         
-                         new_row = pd.DataFrame([{
-                            'date': pd.to_datetime(p_date),
-                            'amount': p_amount,
-                            'currency': 'EUR',
-                            'account': p_account,
-                            'category': p_cat,
-                            'tags': final_tags,
-                            'description': current_tx.get('description'),
-                            'type': p_type,
-                            'source_file': 'screenshot_review',
-                            'original_description': current_tx.get('description'),
-                            'necessity': p_nec
-                        }])
-                         
-                         data_manager._process_and_insert(new_row, 'screenshot_review')
-                         st.toast("Transaction Added!", icon="✅")
-                         
-                         # Remove from list
-                         pending_data.pop(0)
-                         with open(pending_file, 'w') as f:
-                             json.dump(pending_data, f, indent=4)
-                             
-                         st.rerun()
-                         
-                    if col_b2.button("❌ Discard/Ignore", use_container_width=True):
-                         pending_data.pop(0)
-                         with open(pending_file, 'w') as f:
-                             json.dump(pending_data, f, indent=4)
-                         st.rerun()
-                         
-                st.write("---")
-                st.caption(f"Remaining items: {len(pending_data)}")
-                if len(pending_data) > 1:
-                    with st.expander("View Upcoming Queue"):
-                         st.table(pd.DataFrame(pending_data[1:]))
+            # Tabella modificabile: si spuntano le righe da confermare e si inseriscono
+            # tutte insieme con un solo _process_and_insert
+            cats = data_manager.get_unique_categories()
+            accounts = data_manager.get_unique_accounts() or ["Cash"]
+
+            review_df = pd.DataFrame(pending_data)
+            # Nessuna riga pre-selezionata: si spuntano solo quelle riviste
+            review_df = pd.DataFrame({
+                'confirm': False,
+                'date': pd.to_datetime(review_df['date'], errors='coerce').dt.date,
+                'description': review_df['description'].fillna('').astype(str),
+                'amount': pd.to_numeric(review_df['amount'], errors='coerce').fillna(0.0),
+                'category': cats[0] if cats else "General",
+                'account': accounts[0],
+                'tags': "",
+                'necessity': "Need",
+            })
+
+            edited = st.data_editor(
+                review_df,
+                # la chiave cambia quando la coda viene riscritta: niente modifiche
+                # rimaste agganciate a righe che non ci sono più
+                key=f"pending_review_{_pending_mtime(pending_file)}",
+                hide_index=True,
+                use_container_width=True,
+                num_rows="fixed",
+                column_config={
+                    'confirm': st.column_config.CheckboxColumn("✔"),
+                    'date': st.column_config.DateColumn("Date"),
+                    'description': st.column_config.TextColumn("Description"),
+                    'amount': st.column_config.NumberColumn("Amount", format="€%.2f", step=0.01),
+                    'category': st.column_config.SelectboxColumn("Category", options=cats or ["General"]),
+                    'account': st.column_config.SelectboxColumn("Wallet / Account", options=accounts),
+                    'tags': st.column_config.TextColumn("Tags (comma separated)"),
+                    'necessity': st.column_config.SelectboxColumn("Necessity", options=["Need", "Want"]),
+                },
+            )
+
+            selected = edited['confirm'].to_numpy(dtype=bool)
+            col_b1, col_b2 = st.columns([1, 1])
+            if col_b1.button(f"✅ Confirm selected ({int(selected.sum())})", type="primary",
+                             use_container_width=True, disabled=not selected.any()):
+                sel = edited[selected]
+                # Costruzione per colonne (array già tipizzati), non lista di dict riga per riga
+                amounts = sel['amount'].to_numpy(dtype='float64')
+                descs = sel['description'].to_numpy(dtype=object)
+                new_rows = pd.DataFrame({
+                    'date': pd.to_datetime(sel['date']).to_numpy(),
+                    'amount': amounts,
+                    'currency': 'EUR',
+                    'account': sel['account'].to_numpy(dtype=object),
+                    'category': sel['category'].to_numpy(dtype=object),
+                    'tags': [[t.strip() for t in str(x or '').split(',') if t.strip()] for x in sel['tags']],
+                    'description': descs,
+                    'type': np.where(amounts < 0, 'Expense', 'Income'),
+                    'source_file': 'screenshot_review',
+                    'original_description': descs,
+                    'necessity': sel['necessity'].to_numpy(dtype=object),
+                })
+                data_manager._process_and_insert(new_rows, 'screenshot_review')
+                st.toast(f"{len(new_rows)} transactions added!", icon="✅")
+
+                # Tombstone per le righe confermate: la coda non viene riscritta
+                done_ids = [tx['_id'] for tx, sel in zip(pending_data, selected) if sel]
+                _drop_pending(pending_file, done_ids, pending_data, pending_dead)
+                st.rerun()
+
+            # Lo scarto non si annulla: serve una conferma esplicita
+            sure = col_b2.checkbox(f"Yes, discard {int(selected.sum())} selected", value=False,
+                                   key="pending_discard_sure", disabled=not selected.any())
+            if col_b2.button("❌ Discard selected", use_container_width=True,
+                             disabled=not (selected.any() and sure)):
+                done_ids = [tx['_id'] for tx, sel in zip(pending_data, selected) if sel]
+                _drop_pending(pending_file, done_ids, pending_data, pending_dead)
+                st.rerun()
 
     with tabs[tab_offset]:
         st.subheader("Import Backup/Export")
@@ -135,21 +261,12 @@ def render_importer(data_manager: DataManager):
         )
 
         if uploaded_file:
-            # Save temp file
-            temp_path = uploaded_file.name
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-
             if st.button("Process Import"):
                 with st.spinner("Importing and normalizing..."):
-                    success, msg = data_manager.ingest_zip(temp_path, respect_existing_category=respect_cat)
+                    # L'upload è già in memoria: lo ZIP si legge dal buffer, senza file temporanei
+                    success, msg = data_manager.ingest_zip_bytes(uploaded_file, respect_existing_category=respect_cat)
                     if success:
                         st.success(f"Done! {msg}")
-                        # Clean up
-                        try:
-                            os.remove(temp_path)
-                        except:
-                            pass
                     else:
                         st.error(f"Error: {msg}")
 
@@ -158,13 +275,8 @@ def render_importer(data_manager: DataManager):
         pdf_file = st.file_uploader("Upload PDF Bill", type="pdf")
         
         if pdf_file:
-            if 'bill_data' not in st.session_state or st.session_state.get('last_pdf') != pdf_file.name:
-                with st.spinner("Scanning document..."):
-                    parser = PDFParser()
-                    st.session_state.bill_data = parser.extract_bill_data(pdf_file)
-                    st.session_state.last_pdf = pdf_file.name
-            
-            data = st.session_state.bill_data
+            raw = pdf_file.getvalue()
+            data = _parse_bill(hashlib.md5(raw).hexdigest(), raw)
             
             if "error" in data:
                 st.error(data["error"])
@@ -202,25 +314,23 @@ def render_importer(data_manager: DataManager):
                         # Prepare row
                         final_tags = [t.strip() for t in b_tags.split(',') if t.strip()]
                         
-                        new_row = pd.DataFrame([{
-                            'date': pd.to_datetime(b_date),
-                            'amount': -abs(b_amount), # Ensure negative
-                            'currency': 'EUR',
-                            'account': b_account,
-                            'category': b_cat,
-                            'tags': final_tags,
-                            'description': b_desc,
-                            'type': 'Expense',
-                            'source_file': 'pdf_import',
-                            'original_description': b_desc,
-                            'necessity': 'Need'
-                        }])
+                        new_row = pd.DataFrame({
+                            'date': [pd.to_datetime(b_date)],
+                            'amount': [-abs(b_amount)], # Ensure negative
+                            'currency': ['EUR'],
+                            'account': [b_account],
+                            'category': [b_cat],
+                            'tags': [final_tags],
+                            'description': [b_desc],
+                            'type': ['Expense'],
+                            'source_file': ['pdf_import'],
+                            'original_description': [b_desc],
+                            'necessity': ['Need']
+                        })
                         
                         try:
                             data_manager._process_and_insert(new_row, 'pdf_import')
                             st.toast("Bill Imported Successfully!", icon="📄")
-                            # Clear state
-                            del st.session_state.bill_data
                             st.rerun()
                         except Exception as e:
                             st.error(f"Error saving: {e}")
@@ -234,47 +344,26 @@ def render_importer(data_manager: DataManager):
         if uploaded_img:
             st.image(uploaded_img, caption="Preview", width=300)
             
-            if st.button("🔍 Process Screenshot"):
-                status = st.status("Processing screenshot...", expanded=True)
-                try:
-                    status.write("⏳ Loading OCR engine (first run downloads models ~100MB)...")
-                    ocr = OCREngine()
-                    status.write("✅ OCR Engine ready!")
-                    
-                    status.write("🔍 Reading text from image...")
-                    img_bytes = uploaded_img.read()
-                    results, raw_text = ocr.extract_transaction_data(img_bytes)
-                    
-                    if results:
-                        status.update(label="✅ Done!", state="complete")
-                        st.success(f"Found {len(results)} transactions!")
-                        
-                        # Append to pending
-                        current_pending = []
-                        if os.path.exists(pending_file):
-                            try:
-                                with open(pending_file, 'r') as f:
-                                    current_pending = json.load(f)
-                            except:
-                                pass
-                        
-                        current_pending.extend(results)
-                        
-                        with open(pending_file, 'w') as f:
-                            json.dump(current_pending, f, indent=4)
-                            
-                        st.toast("Transactions added to Review Queue!", icon="🚀")
-                        st.rerun()
-                    else:
-                        status.update(label="⚠️ No transactions found", state="complete")
-                        st.warning("No transactions found. Try cropping the image to just the list.")
-                        with st.expander("Show Debug (Raw Text)"):
-                            st.write(raw_text)
-                            st.caption("If you see the text here but it wasn't captured, copy this and send it to me!")
-                        
-                except Exception as e:
-                    import traceback
-                    status.update(label="❌ Error", state="error")
-                    st.error(f"OCR Error: {e}")
-                    with st.expander("Error Details"):
-                        st.code(traceback.format_exc())
+            if st.button("🔍 Process Screenshot", disabled='ocr_future' in st.session_state):
+                # OCR in un thread di background: il rerun non resta bloccato e la
+                # pagina rimane utilizzabile mentre il modello lavora
+                ocr = _get_ocr()
+                st.session_state.ocr_future = _ocr_executor().submit(
+                    ocr.extract_transaction_data, uploaded_img.getvalue())
+
+        if 'ocr_future' in st.session_state:
+            _ocr_job_status(pending_file)
+
+        outcome = st.session_state.pop('ocr_outcome', None)
+        if outcome is not None:
+            kind, payload = outcome
+            if kind == 'empty':
+                st.warning("No transactions found. Try cropping the image to just the list.")
+                with st.expander("Show Debug (Raw Text)"):
+                    st.write(payload)
+                    st.caption("If you see the text here but it wasn't captured, copy this and send it to me!")
+            else:
+                err, details = payload
+                st.error(f"OCR Error: {err}")
+                with st.expander("Error Details"):
+                    st.code(details)
@@ -1,9 +1,56 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from src.data_manager import DataManager
 
+# Oltre questa soglia il multiselect dei tag mostra solo i più usati
+MAX_TAG_OPTIONS = 100
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _lookups(_dm, db_path, data_version):
+    """Categorie, conti e tag più usati: query rieseguite solo quando il DB cambia."""
+    top_tags = _dm.get_tag_frequencies().head(MAX_TAG_OPTIONS).index.tolist()
+    return _dm.get_unique_categories(), _dm.get_unique_accounts(), top_tags
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _projections(_dm, end_date, db_path, data_version):
+    """Ricorrenze proiettate fino a `end_date`: ricalcolate solo se cambia la data o il DB."""
+    return _dm.get_projected_recurring(end_date)
+
+
+def _norm_tags(v, sort=True):
+    """Tag di una cella dell'editor come tupla (lista, array o scalare/NaN)."""
+    if hasattr(v, 'tolist'):
+        v = v.tolist()
+    if not isinstance(v, (list, tuple)):
+        v = [] if pd.isna(v) else [str(v)]
+    return tuple(sorted(v)) if sort else tuple(v)
+
+
+@st.fragment
+def _generate_due(data_manager):
+    """Bottone "Check & Generate Due": il click riesegue solo questo frammento;
+    la pagina intera viene rieseguita solo se sono state generate transazioni."""
+    if st.button("🔄 Check & Generate Due", type="primary", use_container_width=True):
+        with st.spinner("Checking due expenses..."):
+            count = data_manager.process_recurring()
+        if count > 0:
+            # Le scadenze sono avanzate: proiezioni e lista vanno ridisegnate
+            st.toast(f"Generated {count} transactions!", icon="✅")
+            st.rerun()
+        else:
+            st.info("No expenses due today.")
+            st.toast("No expenses due today.", icon="ℹ️")
+
+
 def render_recurring(data_manager: DataManager):
     st.title("🔁 Recurring Expenses (Spese Fisse)")
+    cats, accts, tags_all = _lookups(data_manager, data_manager.db_path, data_manager.data_version)
+    # Opzioni condivise da form e data_editor, costruite una volta per rerun
+    cats_opts = cats + ["Other"]
+    accts_opts = accts or ["Cash"]
     
     # --- Action Section ---
     col_act_1, col_act_2 = st.columns([3, 1])
@@ -11,16 +58,7 @@ def render_recurring(data_manager: DataManager):
         st.info("Manage your fixed expenses here. The system will automatically generate transactions when they are due.")
     
     with col_act_2:
-        if st.button("🔄 Check & Generate Due", type="primary", use_container_width=True):
-            with st.spinner("Checking due expenses..."):
-                count = data_manager.process_recurring()
-                if count > 0:
-                    st.success(f"Generated {count} transactions!")
-                    st.toast(f"Generated {count} transactions!", icon="✅")
-                    # Optional: st.rerun() if we want to show them immediately in a log, but not strictly needed here
-                else:
-                    st.info("No expenses due today.")
-                    st.toast("No expenses due today.", icon="ℹ️")
+        _generate_due(data_manager)
 
     # --- Upcoming Projections Section ---
     from datetime import date, timedelta
@@ -31,49 +69,54 @@ def render_recurring(data_manager: DataManager):
     today = date.today()
     next_30 = today + timedelta(days=30)
     
-    proj_idx = data_manager.get_projected_recurring(next_30)
+    proj_idx = _projections(data_manager, next_30, data_manager.db_path, data_manager.data_version)
     
     if not proj_idx.empty:
-        # Sort by date
-        proj_idx = proj_idx.sort_values('date')
+        # date arriva come oggetti date Python: una sola conversione a datetime64,
+        # poi sort e differenze in giorni lavorano sulla colonna nativa
+        proj_idx = proj_idx.assign(date=pd.to_datetime(proj_idx['date'])).sort_values('date', kind='stable')
         
         # Display nicely
         
         # Summary metrics
-        total_p = proj_idx[proj_idx['amount'] < 0]['amount'].sum()
+        amounts = proj_idx['amount'].to_numpy()
+        total_p = amounts[amounts < 0].sum()
         st.caption(f"Total scheduled expenses: **€{total_p:,.2f}**")
         
-        # Cards
-        for i, row in proj_idx.iterrows():
-            days_left = (row['date'] - today).days
-            
-            # Color coding
-            if days_left < 0:
-                 status = "⚠️ OVERDUE"
-                 color = "#FFCDD2" # Red Light
-            elif days_left == 0:
-                 status = "🔥 TODAY"
-                 color = "#FFF9C4" # Yellow Light
-            elif days_left <= 7:
-                 status = f"⏰ In {days_left} days"
-                 color = "#E1F5FE" # Blue Light
-            else:
-                 status = f"🗓 In {days_left} days"
-                 color = "#F5F5F5" # Grey
-            
-            with st.container():
-                st.markdown(f"""
-                <div style="background-color: {color}; padding: 10px; border-radius: 8px; margin-bottom: 8px; display: flex; align-items: center; justify-content: space-between;">
-                    <div style="flex-grow: 1;">
-                        <span style="font-weight: bold; font-size: 1.1em; color: #333;">{row['name']}</span>
-                         <br><span style="font-size: 0.9em; color: #666;">{row['date'].strftime('%d %b %Y')} ({row['frequency']})</span>
-                    </div>
-                    <div style="text-align: right;">
-                        <span style="font-weight: bold; color: {'red' if row['amount'] < 0 else 'green'}; font-size: 1.1em;">€{row['amount']:.2f}</span>
-                        <br><span style="font-size: 0.85em; font-weight: bold; color: #555;">{status}</span>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+        # Tabella unica (griglia virtualizzata) al posto di una card HTML per riga:
+        # giorni/stato/colori calcolati per colonna
+        dates = proj_idx['date']
+        days_left = (dates - pd.Timestamp(today)).dt.days.to_numpy()
+        in_days = (" In " + pd.Series(days_left).astype(str) + " days").to_numpy(dtype=object)
+        conds = [days_left < 0, days_left == 0, days_left <= 7]
+        status = np.select(conds, ["⚠️ OVERDUE", "🔥 TODAY", "⏰" + in_days], default="🗓" + in_days)
+        # Red Light / Yellow Light / Blue Light / Grey
+        row_css = "background-color: " + np.select(conds, ["#FFCDD2", "#FFF9C4", "#E1F5FE"], default="#F5F5F5").astype(object)
+
+        upcoming = pd.DataFrame({
+            'name': proj_idx['name'].to_numpy(),
+            'date': dates.to_numpy(),
+            'frequency': proj_idx['frequency'].to_numpy(),
+            'amount': amounts,
+            'status': status,
+        })
+        # Stili per colonna già calcolati: nessuna funzione Python chiamata cella per cella
+        amt_css = np.where(amounts < 0, "color: red; font-weight: bold", "color: green; font-weight: bold")
+        styled = (upcoming.style
+                  .apply(lambda col: row_css, axis=0)
+                  .apply(lambda col: amt_css, axis=0, subset=['amount']))
+        st.dataframe(
+            styled,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                'name': st.column_config.TextColumn("Name"),
+                'date': st.column_config.DateColumn("Date", format="DD MMM YYYY"),
+                'frequency': st.column_config.TextColumn("Frequency"),
+                'amount': st.column_config.NumberColumn("Amount", format="€%.2f"),
+                'status': st.column_config.TextColumn("Status"),
+            },
+        )
                 
     else:
         st.info("No recurring expenses scheduled for the next 30 days.")
@@ -87,30 +130,59 @@ def render_recurring(data_manager: DataManager):
         st.caption("Servizi ancora attivi rilevati nelle transazioni ma non tra le ricorrenti. "
                    "Frequenza e importo sono dedotti dai pagamenti recenti (gli abbonamenti "
                    "senza pagamenti recenti vengono ignorati automaticamente).")
-        _freq_lbl = {'Monthly': 'mese', 'Yearly': 'anno', 'Weekly': 'sett.'}
-        for s in suggestions:
-            c1, c2, c3, c4 = st.columns([3, 3, 1, 1])
-            c1.markdown(f"**{s['tag'].title()}** — €{s['amount']:,.2f}/{_freq_lbl.get(s['frequency'], 'mese')}")
-            c2.caption(f"{s['frequency']} · {s['n']} pagamenti · ultimo {s['last']} · cat. {s['category']}")
-            if c3.button("➕ Aggiungi", key=f"sug_add_{s['tag']}", use_container_width=True):
-                from datetime import date
-                data_manager.add_recurring(
-                    name=s['tag'].title(),
-                    amount=-abs(s['amount']),
-                    category=s['category'],
-                    account=s['account'],
-                    frequency=s['frequency'],
-                    start_date=date.today(),
-                    description=s['tag'].title(),
-                    tags=[s['tag']],
-                )
-                st.success(f"'{s['tag'].title()}' aggiunto ({s['frequency']}, €{s['amount']:,.2f}). "
-                           "Rifinisci data/importo qui sotto se serve.")
-                st.rerun()
-            if c4.button("🙈 Ignora", key=f"sug_ign_{s['tag']}", use_container_width=True):
-                data_manager.ignore_subscription_suggestion(s['tag'])
-                st.toast(f"Suggerimento '{s['tag']}' ignorato.")
-                st.rerun()
+        # Un'unica tabella con selezione al posto di 4 elementi (testo + 2 bottoni) per suggerimento
+        sug_df = pd.DataFrame(suggestions)
+        sug_view = pd.DataFrame({
+            'select': False,
+            'name': sug_df['tag'].str.title(),
+            'amount': sug_df['amount'],
+            'frequency': sug_df['frequency'],
+            'n': sug_df['n'],
+            'last': sug_df['last'],
+            'category': sug_df['category'],
+        })
+        sug_edit = st.data_editor(
+            sug_view,
+            key="sug_editor",
+            hide_index=True,
+            use_container_width=True,
+            disabled=['name', 'amount', 'frequency', 'n', 'last', 'category'],
+            column_config={
+                'select': st.column_config.CheckboxColumn("✔"),
+                'name': st.column_config.TextColumn("Servizio"),
+                'amount': st.column_config.NumberColumn("Importo", format="€%.2f"),
+                'frequency': st.column_config.TextColumn("Frequenza"),
+                'n': st.column_config.NumberColumn("Pagamenti"),
+                'last': st.column_config.TextColumn("Ultimo"),
+                'category': st.column_config.TextColumn("Categoria"),
+            },
+        )
+        picked = sug_df[sug_edit['select'].to_numpy(dtype=bool)]
+        c1, c2 = st.columns(2)
+        if c1.button(f"➕ Aggiungi selezionati ({len(picked)})", key="sug_add",
+                     use_container_width=True, disabled=picked.empty):
+            names = picked['tag'].str.title()
+            data_manager.bulk_upsert_recurring(to_add=[
+                {
+                    'name': name,
+                    'amount': -abs(amt),
+                    'category': cat,
+                    'account': acc,
+                    'frequency': freq,
+                    'next_date': today,
+                    'description': name,
+                    'tags': [tag],
+                }
+                for tag, name, amt, cat, acc, freq in zip(
+                    picked['tag'], names, picked['amount'], picked['category'],
+                    picked['account'], picked['frequency'])
+            ])
+            st.success(f"Aggiunti: {', '.join(names)}. Rifinisci data/importo qui sotto se serve.")
+            st.rerun()
+        if c2.button("🙈 Ignora selezionati", key="sug_ign", use_container_width=True, disabled=picked.empty):
+            data_manager.ignore_subscription_suggestion(picked['tag'].tolist())
+            st.toast(f"Suggerimenti ignorati: {', '.join(picked['tag'])}.")
+            st.rerun()
         st.divider()
 
     # --- Add New Recurring ---
@@ -123,13 +195,13 @@ def render_recurring(data_manager: DataManager):
             with col1:
                 r_name = st.text_input("Template Name", placeholder="e.g. Netflix Subscription")
                 r_amount = st.number_input("Amount (Negative for Expense)", value=-10.0, step=1.0, help="Use negative values for expenses, positive for income.")
-                r_cat = st.selectbox("Category", data_manager.get_unique_categories() + ["Other"])
+                r_cat = st.selectbox("Category", cats_opts)
                 if r_cat == "Other":
                    r_cat_custom = st.text_input("New Category Name")
                    r_cat = r_cat_custom if r_cat_custom else "General"
                    
             with col2:
-                r_acc = st.selectbox("Account/Wallet", data_manager.get_unique_accounts())
+                r_acc = st.selectbox("Account/Wallet", accts_opts)
                 r_freq = st.selectbox("Frequency", ["Monthly", "Weekly", "Yearly"])
                 r_date = st.date_input("Next Due Date")
 
@@ -153,8 +225,8 @@ def render_recurring(data_manager: DataManager):
             r_desc = st.text_input("Description for Transaction", placeholder="e.g. Monthly subscription payment")
             
             # Tags handling
-            existing_tags = data_manager.get_unique_tags()
-            r_tags_sel = st.multiselect("Tags", existing_tags, placeholder="Select tags...")
+            r_tags_sel = st.multiselect("Tags", tags_all, placeholder="Select tags...",
+                                        help=f"Most used {MAX_TAG_OPTIONS} tags; type any other below.")
             r_new_tag = st.text_input("Add New Tag (Optional)", placeholder="e.g. #subscription")
             
             submitted = st.form_submit_button("Save Template")
@@ -163,8 +235,8 @@ def render_recurring(data_manager: DataManager):
                 if not r_name:
                     st.error("Name is required.")
                 else:
-                    # Merge tags
-                    final_tags = r_tags_sel
+                    # Merge tags (copia: la lista restituita dal widget non va modificata)
+                    final_tags = list(r_tags_sel)
                     if r_new_tag:
                         clean = r_new_tag.strip().replace('#', '').lower()
                         if clean and clean not in final_tags:
@@ -173,9 +245,6 @@ def render_recurring(data_manager: DataManager):
                     # Final Description fallback
                     final_desc = r_desc if r_desc else r_name
                     
-                    # Final Description fallback
-                    final_desc = r_desc if r_desc else r_name
-                    
                     data_manager.add_recurring(r_name, r_amount, r_cat, r_acc, r_freq, r_date, final_desc, final_tags, r_installments, r_end_date)
                     st.success(f"Recurring expense '{r_name}' added!")
                     st.rerun()
@@ -194,8 +263,8 @@ def render_recurring(data_manager: DataManager):
         column_config = {
             "name": st.column_config.TextColumn("Name", required=True),
             "amount": st.column_config.NumberColumn("Amount", format="€%.2f", required=True),
-            "category": st.column_config.SelectboxColumn("Category", options=data_manager.get_unique_categories() + ["Other"], required=True),
-            "account": st.column_config.SelectboxColumn("Account", options=data_manager.get_unique_accounts(), required=True),
+            "category": st.column_config.SelectboxColumn("Category", options=cats_opts, required=True),
+            "account": st.column_config.SelectboxColumn("Account", options=accts_opts, required=True),
             "frequency": st.column_config.SelectboxColumn("Frequency", options=["Monthly", "Weekly", "Yearly"], required=True),
             "next_date": st.column_config.DateColumn("Next Due", required=True),
             "end_date": st.column_config.DateColumn("Ends On"),
@@ -219,79 +288,56 @@ def render_recurring(data_manager: DataManager):
             # Similar logic to transactions: Diff or Update All
             # Since number of recurring expenses is small, we can just update those that changed or are new.
             
-            changes_count = 0
-            
-            # 1. Access original DF by ID to track changes
-            # Convert to dict for fast lookup
+            # Le modifiche vengono raccolte e scritte insieme in una sola transazione
+            to_add, to_update = [], []
             
             # --- Handle Deletions ---
             original_ids = set(rec_df['id'].dropna())
             current_ids = set(edited_rec_df['id'].dropna())
-            deleted_ids = original_ids - current_ids
-            
-            for d_id in deleted_ids:
-                data_manager.delete_recurring(d_id)
-                changes_count += 1
+            to_delete = list(original_ids - current_ids)
                 
-            # --- Handle Updates & New ---
-            for i, row in edited_rec_df.iterrows():
-                # Check if New (No ID)
-                if pd.isna(row.get('id')) or row.get('id') == '':
-                    # It's a new row added via UI
-                    # We need to map columns to add_recurring arguments
-                    # Ensure minimal fields
-                    if row['name']:
-                         # Handle tags
-                         tags_val = row['tags']
-                         if hasattr(tags_val, 'tolist'): tags_val = tags_val.tolist()
-                         if not isinstance(tags_val, list): tags_val = []
-                         
-                         data_manager.add_recurring(
-                             name=row['name'],
-                             amount=row['amount'],
-                             category=row.get('category', 'General'),
-                             account=row.get('account', 'Cash'),
-                             frequency=row.get('frequency', 'Monthly'),
-                             start_date=row['next_date'],
-                             description=row.get('description', ''),
-                             tags=tags_val,
-                             installments=row.get('remaining_installments'),
-                             end_date=row.get('end_date')
-                         )
-                         changes_count += 1
+            # --- Handle New (rows added via UI, no ID) ---
+            is_new = edited_rec_df['id'].isna() | (edited_rec_df['id'] == '')
+            new_rows = edited_rec_df[is_new & edited_rec_df['name'].fillna('').astype(bool)]
+            for row in new_rows.to_dict('records'):
+                to_add.append({
+                    'name': row['name'],
+                    'amount': row['amount'],
+                    'category': row.get('category', 'General'),
+                    'account': row.get('account', 'Cash'),
+                    'frequency': row.get('frequency', 'Monthly'),
+                    'next_date': row['next_date'],
+                    'description': row.get('description', ''),
+                    'tags': list(_norm_tags(row['tags'], sort=False)),
+                    'remaining_installments': row.get('remaining_installments'),
+                    'end_date': row.get('end_date')
+                })
+
+            # --- Handle Updates: diff vettoriale vecchio/nuovo allineato per id ---
+            fields = ['name', 'amount', 'category', 'account', 'frequency', 'next_date', 'description', 'remaining_installments', 'end_date', 'tags']
+            merged = rec_df.set_index('id')[fields].join(
+                edited_rec_df[~is_new].set_index('id')[fields], lsuffix='_old', rsuffix='_new', how='inner')
+            changed = pd.DataFrame(index=merged.index)
+            for f in fields:
+                old, new = merged[f + '_old'], merged[f + '_new']
+                if f == 'tags':
+                    changed[f] = old.map(_norm_tags) != new.map(_norm_tags)
                 else:
-                    # It's an existing row. Check for changes.
-                    # We can compare against original row with same ID
-                    orig_row = rec_df[rec_df['id'] == row['id']].iloc[0]
-                    
-                    # Fields to check
-                    fields = ['name', 'amount', 'category', 'account', 'frequency', 'next_date', 'description', 'remaining_installments', 'end_date', 'tags']
-                    updates = {}
-                    
-                    for f in fields:
-                        val_new = row.get(f)
-                        val_old = orig_row.get(f)
-                        
-                        # Normalize for comparison
-                        if f == 'tags':
-                             if hasattr(val_new, 'tolist'): val_new = val_new.tolist()
-                             if not isinstance(val_new, list): val_new = [] if pd.isna(val_new) else [str(val_new)]
-                             
-                             if hasattr(val_old, 'tolist'): val_old = val_old.tolist()
-                             if not isinstance(val_old, list): val_old = [] if pd.isna(val_old) else [str(val_old)]
-                             
-                             if tuple(sorted(val_new)) != tuple(sorted(val_old)):
-                                 updates[f] = val_new
-                        else:
-                             # Handle NaNs
-                             if pd.isna(val_new) and pd.isna(val_old): continue
-                             if val_new != val_old:
-                                 updates[f] = val_new
-                                 
-                    if updates:
-                        data_manager.update_recurring(row['id'], **updates)
-                        changes_count += 1
+                    changed[f] = (old != new) & ~(old.isna() & new.isna())
+
+            # Righe modificate -> dict per id (lookup O(1), niente Series per riga)
+            changed = changed[changed.any(axis=1)]
+            new_by_id = merged.loc[changed.index, [f + '_new' for f in fields]].to_dict('index')
+            for rec_id, mask in zip(changed.index, changed.to_numpy()):
+                row_new = new_by_id[rec_id]
+                updates = {}
+                for f, is_changed in zip(fields, mask):
+                    if is_changed:
+                        val_new = row_new[f + '_new']
+                        updates[f] = list(_norm_tags(val_new, sort=False)) if f == 'tags' else val_new
+                to_update.append((rec_id, updates))
             
+            changes_count = data_manager.bulk_upsert_recurring(to_add, to_update, to_delete)
             if changes_count > 0:
                 st.success(f"Saved {changes_count} changes!")
                 st.rerun()
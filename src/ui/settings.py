@@ -3,9 +3,35 @@ import yaml
 import pandas as pd
 from src.data_manager import DataManager
 
+# Icone selezionabili per i portafogli (+ indice per il default del selectbox)
+ICON_OPTIONS = ("👛", "🏦", "💳", "💵", "🐷", "📈", "🏠", "🚗", "👶", "✈️", "🎁", "🔧")
+_ICON_IDX = {ic: i for i, ic in enumerate(ICON_OPTIONS)}
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _lookups(_dm, db_path, data_version):
+    """Categorie, conti e tag distinti: tre DISTINCT rieseguiti solo quando il DB cambia."""
+    return _dm.get_unique_categories(), _dm.get_unique_accounts(), _dm.get_unique_tags()
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def cached_backup_zip(_dm, db_path, data_version):
+    """ZIP di backup (transazioni + ricorrenti) ricostruito solo quando il DB cambia."""
+    return _dm.export_backup_zip()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _account_balances(_dm, db_path, data_version):
+    """Saldo per conto {account: totale}: l'aggregato gira solo quando il DB cambia."""
+    rows = _dm.con.execute("SELECT account, SUM(amount) AS total FROM transactions GROUP BY account").fetchall()
+    return {acc: total for acc, total in rows}
+
+
 def render_settings(data_manager: DataManager):
     import pandas as pd
     st.header("Settings & Rules")
+    # Valori distinti letti una volta e riusati da tutti i widget della pagina
+    uniq_cats, uniq_accts, uniq_tags = _lookups(data_manager, data_manager.db_path, data_manager.data_version)
     
     # --- Initial Balance ---
     st.subheader("💰 Initial Balance (Patrimonio Iniziale)")
@@ -77,29 +103,38 @@ def render_settings(data_manager: DataManager):
         st.write("### Existing Categories")
         
         categories = current_rules.get('categories', [])
-        for i, cat in enumerate(categories):
-            with st.expander(f"{cat.get('name')} ({cat.get('necessity', 'Want')})"):
-                name = st.text_input(f"Name #{i}", cat.get('name'), key=f"name_{i}")
-                necessity = st.selectbox(f"Necessity #{i}", ["Need", "Want"], 
-                                       index=0 if cat.get('necessity') == 'Need' else 1, 
-                                       key=f"nec_{i}")
-                
-                current_keywords = ", ".join(cat.get('match', []))
-                keywords_str = st.text_area(f"Keywords #{i}", current_keywords, key=f"kw_{i}")
-                
-                col_save, col_delete = st.columns([1, 5])
-                if col_save.button("Update", key=f"btn_up_{i}"):
-                    keywords = [k.strip() for k in keywords_str.split(',') if k.strip()]
+        # Un unico form: le modifiche si raccolgono e il YAML si scrive una volta sola
+        with st.form("edit_cats_form"):
+            edits = []
+            for i, cat in enumerate(categories):
+                with st.expander(f"{cat.get('name')} ({cat.get('necessity', 'Want')})"):
+                    name = st.text_input(f"Name #{i}", cat.get('name'), key=f"name_{i}")
+                    necessity = st.selectbox(f"Necessity #{i}", ["Need", "Want"], 
+                                           index=0 if cat.get('necessity') == 'Need' else 1, 
+                                           key=f"nec_{i}")
+                    
+                    current_keywords = ", ".join(cat.get('match', []))
+                    keywords_str = st.text_area(f"Keywords #{i}", current_keywords, key=f"kw_{i}")
+                    delete = st.checkbox("Delete Strategy", key=f"del_{i}")
+                    edits.append((cat, name, necessity, keywords_str, delete))
+
+            if st.form_submit_button("💾 Save All Changes", disabled=not categories):
+                kept = []
+                for cat, name, necessity, keywords_str, delete in edits:
+                    if delete:
+                        continue
                     cat['name'] = name
                     cat['necessity'] = necessity
-                    cat['match'] = keywords
-                    rules_engine.save_rules(current_rules)
-                    st.success("Updated!")
-                
-                if col_delete.button("Delete Strategy", key=f"btn_del_{i}"):
-                    current_rules['categories'].pop(i)
-                    rules_engine.save_rules(current_rules)
-                    st.rerun()
+                    cat['match'] = [k.strip() for k in keywords_str.split(',') if k.strip()]
+                    kept.append(cat)
+                current_rules['categories'] = kept
+                rules_engine.save_rules(current_rules)
+                # Gli indici cambiano dopo un'eliminazione: azzera lo stato dei widget
+                for i in range(len(edits)):
+                    for k in (f"name_{i}", f"nec_{i}", f"kw_{i}", f"del_{i}"):
+                        st.session_state.pop(k, None)
+                st.toast(f"Saved {len(kept)} categories ({len(edits) - len(kept)} deleted).")
+                st.rerun()
 
     st.divider()
 
@@ -123,7 +158,7 @@ def render_settings(data_manager: DataManager):
     except Exception:
         tag_counts = {}
 
-    db_cats = data_manager.get_unique_categories()
+    db_cats = uniq_cats
     rule_cats = [c['name'] for c in current_rules.get('categories', [])]
     all_cats = sorted(set(db_cats + rule_cats))
 
@@ -132,7 +167,7 @@ def render_settings(data_manager: DataManager):
         if r.get('necessity') and r['name'] not in cat_necessity_map:
             cat_necessity_map[r['name']] = r['necessity']
 
-    db_tags = data_manager.get_unique_tags()
+    db_tags = uniq_tags
     tag_necessity_map = current_rules.get('tag_necessity', {})
 
     nec_tab1, nec_tab2 = st.tabs([f"📂 Categorie ({len(all_cats)})", f"🏷️ Tag ({len(db_tags)})"])
@@ -243,32 +278,9 @@ def render_settings(data_manager: DataManager):
         if st.button("Apply Rules to All Data"):
             with st.spinner("Re-applying rules to database..."):
                  try:
-                     df = data_manager.get_transactions()
-                     if not df.empty:
-                         before_cat = df[['id', 'category', 'necessity']].copy()
-
-                         # Re-apply rules in memory
-                         df = rules_engine.apply_rules(df)
-                         df = rules_engine.auto_tag_from_description(df)
-
-                         if 'notes' not in df.columns:
-                             df['notes'] = None
-
-                         # Count what changed
-                         changed_cat = (df['category'] != before_cat['category']).sum()
-                         changed_nec = (df['necessity'] != before_cat['necessity']).sum()
-
-                         # Wrap DELETE + INSERT in a transaction to avoid data loss on failure
-                         data_manager.con.execute("BEGIN TRANSACTION")
-                         try:
-                             data_manager.con.execute("DELETE FROM transactions")
-                             data_manager.con.execute("INSERT INTO transactions SELECT date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity, id, notes FROM df")
-                             data_manager.con.execute("COMMIT")
-                         except Exception as inner_e:
-                             data_manager.con.execute("ROLLBACK")
-                             raise inner_e
-
-                         st.success(f"Rules applied to {len(df)} transactions — {changed_cat} categorie aggiornate, {changed_nec} necessity aggiornate.")
+                     total, changed_cat, changed_nec = data_manager.reapply_rules()
+                     if total:
+                         st.success(f"Rules applied to {total} transactions — {changed_cat} categorie aggiornate, {changed_nec} necessity aggiornate.")
                      else:
                          st.warning("No data to process.")
                  except Exception as e:
@@ -278,11 +290,16 @@ def render_settings(data_manager: DataManager):
         if st.button("Fix +/- Signs (Expense/Income)"):
             with st.spinner("Fixing signs..."):
                 try:
-                    # Update Expense to be negative
-                    data_manager.con.execute("UPDATE transactions SET amount = -ABS(amount) WHERE type = 'Expense'")
-                    # Update Income to be positive
-                    data_manager.con.execute("UPDATE transactions SET amount = ABS(amount) WHERE type = 'Income'")
-                    st.success("Signs fixed! Expenses are now negative, Income positive.")
+                    # Expense negative, Income positive in un solo passaggio,
+                    # toccando solo le righe col segno sbagliato
+                    fixed = data_manager.con.execute("""
+                        UPDATE transactions
+                        SET amount = CASE WHEN type = 'Expense' THEN -ABS(amount) ELSE ABS(amount) END
+                        WHERE (type = 'Expense' AND amount > 0) OR (type = 'Income' AND amount < 0)
+                    """).fetchone()[0]
+                    if fixed:
+                        data_manager.bump_data_version()
+                    st.success(f"Signs fixed! Expenses are now negative, Income positive ({fixed} righe corrette).")
                 except Exception as e:
                     st.error(f"Error fixing signs: {e}")
 
@@ -292,14 +309,12 @@ def render_settings(data_manager: DataManager):
     
     # Get current balances
     try:
-        current_bals = data_manager.con.execute("SELECT account, SUM(amount) as total FROM transactions GROUP BY account").fetchall()
-        # Convert to dict
-        bal_dict = {row[0]: row[1] for row in current_bals}
+        bal_dict = _account_balances(data_manager, data_manager.db_path, data_manager.data_version)
         
         # UI for adjustment
         col_rec_1, col_rec_2, col_rec_3 = st.columns([2, 1, 1])
         with col_rec_1:
-            rec_acc = st.selectbox("Select Account", options=data_manager.get_unique_accounts() + ["New Account..."], key="rec_acc")
+            rec_acc = st.selectbox("Select Account", options=uniq_accts + ["New Account..."], key="rec_acc")
             if rec_acc == "New Account...":
                 rec_acc = st.text_input("Account Name", key="rec_acc_new")
         
@@ -314,20 +329,9 @@ def render_settings(data_manager: DataManager):
         if st.button("Update Balance"):
             diff = target_val - current_val
             if abs(diff) > 0.001:
-                # Insert adjustment
-                # We use a special category 'Adjustment'
+                # Insert adjustment (category 'Adjustment')
                 import datetime
-                today = datetime.date.today()
-                
-                # Check column consistency
-                # insert columns: date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity 
-                # (and uuid handles itself or we add it)
-                
-                q = """
-                INSERT INTO transactions (id, date, amount, currency, account, category, tags, description, type, source_file, original_description, necessity)
-                VALUES (uuid(), ?, ?, 'EUR', ?, 'Adjustment', [], 'Manual Balance Reconciliation', 'Adjustment', 'reconcile', 'Balance Fix', 'Need')
-                """
-                data_manager.con.execute(q, [today, diff, rec_acc])
+                data_manager.add_balance_adjustment(rec_acc, diff, datetime.date.today())
                 
                 st.success(f"Adjusted {rec_acc} by €{diff:,.2f}. New Balance should be €{target_val:,.2f}")
                 st.rerun()
@@ -348,7 +352,7 @@ def render_settings(data_manager: DataManager):
         rules['wallets'] = {}
 
     # Get accounts
-    accounts = data_manager.get_unique_accounts()
+    accounts = uniq_accts
 
     # --- Main Wallet (Portafoglio Principale) ---
     if accounts:
@@ -378,20 +382,18 @@ def render_settings(data_manager: DataManager):
         new_name = st.text_input("Rename to", value=target_account, key='wallet_rename_input')
         
     with col_w3:
-        # Icon picker
-        current_icon_conf = rules['wallets'].get(new_name, {}).get('icon', '👛') if new_name else '👛'
-        # Try to find icon for current target if not renamed yet
-        if target_account in rules['wallets']:
-            current_icon_conf = rules['wallets'][target_account].get('icon', '👛')
-            
-        icon_options = ["👛", "🏦", "💳", "💵", "🐷", "📈", "🏠", "🚗", "👶", "✈️", "🎁", "🔧"]
-        selected_icon = st.selectbox("Icon", icon_options, index=icon_options.index(current_icon_conf) if current_icon_conf in icon_options else 0)
+        # Icon picker: config del portafoglio selezionato, altrimenti del nuovo nome
+        wallets = rules['wallets']
+        wcfg = wallets[target_account] if target_account in wallets else (wallets.get(new_name) if new_name else None)
+        current_icon_conf = (wcfg or {}).get('icon', '👛')
+        selected_icon = st.selectbox("Icon", ICON_OPTIONS, index=_ICON_IDX.get(current_icon_conf, 0))
         
     if st.button("Save Wallet Changes"):
         try:
             # 1. Update Name in DB if changed
             if target_account != new_name:
                 data_manager.con.execute("UPDATE transactions SET account = ? WHERE account = ?", [new_name, target_account])
+                data_manager.bump_data_version()
                 st.toast(f"Renamed '{target_account}' to '{new_name}'")
                 
                 # Check if old name had config, move it
@@ -423,7 +425,7 @@ def render_settings(data_manager: DataManager):
         "così i futuri import finiscono nella categoria giusta."
     )
 
-    mc_cats = data_manager.get_unique_categories()
+    mc_cats = uniq_cats
     if mc_cats:
         mcol1, mcol2 = st.columns(2)
         mc_src = mcol1.selectbox("Da categoria (sparirà)", mc_cats, key='merge_src')
@@ -477,14 +479,15 @@ def render_settings(data_manager: DataManager):
         multi = spread[spread['n_cat'] >= 2].sort_values('n_cat', ascending=False)
         if not multi.empty:
             with st.expander(f"🔎 Tag sparsi su più categorie ({len(multi)}) — possibili errori", expanded=False):
-                for _, row in multi.head(40).iterrows():
-                    tg = row['tag']
-                    sub = inc[inc['tag'] == tg].sort_values('n', ascending=False)
-                    cats_str = " · ".join(f"{r['category']} ({int(r['n'])})" for _, r in sub.iterrows())
-                    st.markdown(f"**#{tg}** → {cats_str}")
-
-    fix_tags = data_manager.get_unique_tags()
-    fix_cats = data_manager.get_unique_categories()
+                # Etichette "categoria (n)" costruite per colonna e raggruppate una volta per tag
+                by_n = inc.sort_values('n', ascending=False, kind='stable')
+                labels = (by_n['category'].map(str) + " (" + by_n['n'].astype(int).astype(str) + ")")
+                cats_by_tag = labels.groupby(by_n['tag'], sort=False).agg(" · ".join).to_dict()
+                for tg in multi['tag'].head(40).tolist():
+                    st.markdown(f"**#{tg}** → {cats_by_tag[tg]}")
+
+    fix_tags = uniq_tags
+    fix_cats = uniq_cats
     if fix_tags and fix_cats:
         fcol1, fcol2 = st.columns(2)
         fix_tag = fcol1.selectbox("Tag da correggere", fix_tags, key='fix_tag')
@@ -495,7 +498,7 @@ def render_settings(data_manager: DataManager):
             cur = inc[inc['tag'] == fix_tag].sort_values('n', ascending=False)
             if not cur.empty:
                 st.caption("Attualmente in: " + " · ".join(
-                    f"{r['category']} ({int(r['n'])})" for _, r in cur.iterrows()))
+                    f"{c} ({int(n)})" for c, n in zip(cur['category'], cur['n'])))
                 only_opts += cur['category'].tolist()
 
         fix_target = fcol2.selectbox("Assegna categoria", fix_cats, key='fix_target')
@@ -572,7 +575,7 @@ def render_settings(data_manager: DataManager):
         else:
             st.info("Dati insufficienti per suggerire budget.")
 
-    db_cats = data_manager.get_unique_categories()
+    db_cats = uniq_cats
     rule_cats = [c['name'] for c in current_rules.get('categories', [])]
     all_cats = sorted(set(db_cats + rule_cats))
 
@@ -602,7 +605,7 @@ def render_settings(data_manager: DataManager):
     st.subheader("📦 Backup & Export")
     st.write("Download a ZIP file containing all your transactions formatted as CSVs.")
     
-    zip_data = data_manager.export_backup_zip()
+    zip_data = cached_backup_zip(data_manager, data_manager.db_path, data_manager.data_version)
     st.download_button(
         label="Download Full Backup (ZIP)",
         data=zip_data,
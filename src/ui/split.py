@@ -1,7 +1,50 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, date
 from src.data_manager import DataManager
+from src.utils import clean_tag
+
+# Tag che, in assenza di regole specifiche, fanno dividere la spesa con la quota di default
+DEFAULT_SPLIT_TAGS = ('split', 'condiviso', 'shared', 'comune')
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _split_periods(_dm, db_path, data_version):
+    """(anno, mese) con spese per i filtri: riletti solo quando il DB cambia."""
+    return tuple(_dm.get_expense_months())
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _split_categories(_dm, db_path, data_version):
+    """Categorie per il form 'Add Rule': rilette solo quando il DB cambia."""
+    return tuple(_dm.get_unique_categories())
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _split_month(_dm, year, month, _split_conf, rules_version, db_path, data_version):
+    """Spese del mese con la quota del partner (vedi DataManager.get_split_month)."""
+    return _dm.get_split_month(year, month, _split_conf, DEFAULT_SPLIT_TAGS)
+
+
+def _prepped_split_conf(rules_engine):
+    """
+    Vista normalizzata di split_config (tag in minuscolo senza '#', regole come
+    tuple), ricostruita solo quando il file regole viene salvato.
+    Ritorna (versione, vista).
+    """
+    ver = (rules_engine.rules_path, rules_engine.version)
+    if st.session_state.get('split_prepped_ver') != ver:
+        conf = rules_engine.rules.get('split_config', {})
+        st.session_state.split_prepped = {
+            'default_share_pct': conf.get('default_share_pct', 50),
+            'loan_tags': tuple(sorted({clean_tag(t) for t in conf.get('loan_tags', []) or []})),
+            'rules': tuple({'type': r['type'], 'match': r['match'], 'my_share': r['my_share']}
+                           for r in conf.get('rules', []) or []),
+        }
+        st.session_state.split_prepped_ver = ver
+    return ver, st.session_state.split_prepped
+
 
 def render_split(data_manager: DataManager):
     st.header("💞 Expense Splitting (Granular)")
@@ -47,30 +90,48 @@ def render_split(data_manager: DataManager):
         
         # Rule Editor
         rules_list = conf.get('rules', [])
+        existing_keys = {(r['type'], r['match']) for r in rules_list}
         
-        # Display existing rules
-        for i, rule in enumerate(rules_list):
-            c1, c2, c3, c4 = st.columns([2, 3, 2, 1])
-            with c1:
-                st.write(f"**{rule['type'].capitalize()}**")
-            with c2:
-                st.write(f"`{rule['match']}`")
-            with c3:
-                st.write(f"My Share: **{rule['my_share']}%**")
-            with c4:
-                if st.button("🗑️", key=f"del_rule_{i}"):
-                    rules_list.pop(i)
-                    conf['rules'] = rules_list
-                    rules_engine.save_rules(full_rules)
-                    st.rerun()
-                    
+        # Regole esistenti in un unico data_editor (modifica/cancellazione righe)
+        rules_cols = ['type', 'match', 'my_share']
+        edited_rules = st.data_editor(
+            pd.DataFrame(rules_list, columns=rules_cols),
+            column_config={
+                'type': st.column_config.SelectboxColumn("Type", options=['tag', 'category'], required=True),
+                'match': st.column_config.TextColumn("Match", required=True),
+                'my_share': st.column_config.NumberColumn("My Share %", min_value=0, max_value=100, step=1, required=True),
+            },
+            use_container_width=True,
+            hide_index=True,
+            num_rows="dynamic",
+            key="split_rules_editor",
+        )
+
+        if st.button("💾 Save Rules"):
+            # Righe incomplete scartate; una sola regola per (tipo, match), vale la prima
+            new_rules, seen = [], set()
+            for t, m, s in edited_rules[rules_cols].itertuples(index=False):
+                if pd.isna(t) or pd.isna(m) or not str(m).strip():
+                    continue
+                m = clean_tag(m) if t == 'tag' else str(m).strip()
+                if (t, m) in seen:
+                    continue
+                seen.add((t, m))
+                new_rules.append({'type': t, 'match': m, 'my_share': int(s) if pd.notna(s) else 50})
+            if new_rules != rules_list:
+                conf['rules'] = new_rules
+                rules_engine.save_rules(full_rules)
+                st.rerun()
+            else:
+                st.info("No changes to save.")
+
         # Add New Rule Form
         with st.expander("➕ Add New Rule"):
             with st.form("add_rule_form"):
                 r_type = st.selectbox("Type", ["Category", "Tag"])
                 
                 if r_type == "Category":
-                    avail_cats = data_manager.get_unique_categories()
+                    avail_cats = _split_categories(data_manager, data_manager.db_path, data_manager.data_version)
                     r_match = st.selectbox("Select Category", avail_cats)
                 else:
                     r_match_input = st.text_input("Tag Name (e.g. luce)", placeholder="Enter tag without #")
@@ -81,8 +142,7 @@ def render_split(data_manager: DataManager):
                 if st.form_submit_button("Add Rule"):
                     if r_match:
                         # Check duplicate
-                        exists = any(r['type'] == r_type.lower() and r['match'] == r_match for r in rules_list)
-                        if not exists:
+                        if (r_type.lower(), r_match) not in existing_keys:
                             rules_list.append({
                                 'type': r_type.lower(),
                                 'match': r_match,
@@ -103,173 +163,38 @@ def render_split(data_manager: DataManager):
         with col_d1:
             today = date.today()
             # Year select
-            df_all = data_manager.get_transactions()
-            if not df_all.empty:
-                years = sorted(df_all['date'].dt.year.unique(), reverse=True)
+            periods = _split_periods(data_manager, data_manager.db_path, data_manager.data_version)
+            if periods:
+                years = list(dict.fromkeys(y for y, _ in periods))
                 if today.year not in years: years.insert(0, today.year)
                 sel_year = st.selectbox("Year", years)
             else:
                 sel_year = today.year
                 
         with col_d2:
-            sel_month = st.selectbox("Month", range(1, 13), index=today.month - 1)
+            # Solo i mesi con spese nell'anno scelto (tutti se l'anno non ne ha ancora)
+            months = sorted(m for y, m in periods if y == sel_year) or list(range(1, 13))
+            default_month = today.month if today.month in months else months[-1]
+            sel_month = st.selectbox("Month", months, index=months.index(default_month))
             
         # Filter Data
-        if df_all.empty:
+        if not periods:
             st.info("No transactions found.")
             return
 
-        df_all['date'] = pd.to_datetime(df_all['date'])
-        mask = (df_all['date'].dt.year == sel_year) & (df_all['date'].dt.month == sel_month) & (df_all['type'] == 'Expense')
-        df_m = df_all[mask].copy()
+        rules_ver, split_conf = _prepped_split_conf(rules_engine)
+        df_m = _split_month(data_manager, sel_year, sel_month, split_conf,
+                            rules_ver, data_manager.db_path, data_manager.data_version)
         
         if df_m.empty:
             st.warning("No expenses found.")
             return
 
-        # Initialize Debug Columns to avoid KeyError
-        df_m['debug_tags_clean'] = ""
-        df_m['debug_log'] = ""
-
         # --- CALCULATION LOGIC ---
-        
-        loan_tags = conf.get('loan_tags', [])
-        rules_list = conf.get('rules', [])
-        default_pct = conf.get('default_share_pct', 50) / 100.0
-        
-        split_transactions = []
-        loan_transactions = []
-        
-        total_partner_owes = 0.0
-        
-        for idx, row in df_m.iterrows():
-            amount = abs(row['amount'])
-            
-            # Robust tag normalization
-            raw_tags = row['tags']
-            tags = []
-            parse_log = []
-            
-            parse_log.append(f"Type: {type(raw_tags).__name__}")
-            parse_log.append(f"Val: {str(raw_tags)}")
-            
-            try:
-                # 1. String check
-                if isinstance(raw_tags, str):
-                    parse_log.append("Is String")
-                    clean_str = raw_tags.strip()
-                    if clean_str.startswith('[') and clean_str.endswith(']'):
-                         parse_log.append("Is Bracketed")
-                         content = clean_str[1:-1]
-                         if content:
-                             parts = content.split(',')
-                             tags = [p.replace("'", "").replace('"', "").lower().replace('#', '').strip() for p in parts]
-                         else:
-                             tags = []
-                    else:
-                        parse_log.append("Is CSV")
-                        if clean_str:
-                             tags = [t.lower().replace('#', '').strip() for t in clean_str.split(',')]
-                        else:
-                             tags = []
-                
-                # 2. Iterable Check (List, Tuple, Numpy Array)
-                elif hasattr(raw_tags, '__iter__'):
-                     parse_log.append("Is Iterable")
-                     # Convert to list safely
-                     tags = [str(t).lower().replace('#', '').strip() for t in raw_tags]
-                     
-                # 3. NA Check (float/None) - ONLY if not iterable
-                elif pd.isna(raw_tags):
-                     parse_log.append("Is Na")
-                     tags = []
-                     
-                else:
-                     parse_log.append("Unknown Type")
-                     tags = []
-                     
-            except Exception as e:
-                parse_log.append(f"Error: {str(e)}")
-                tags = []
-                
-            category = row['category']
-            
-            # 1. Check Loan
-            clean_loan_tags = [t.lower().replace('#', '').strip() for t in loan_tags]
-            is_loan = any(t in tags for t in clean_loan_tags)
-            
-            if is_loan:
-                # Store result but also continue to next (loan overrides split)
-                loan_transactions.append(row)
-                total_partner_owes += amount
-                
-                # Update debug info in DF
-                df_m.at[idx, 'debug_tags_clean'] = str(tags)
-                df_m.at[idx, 'debug_log'] = "Identified as LOAN"
-                continue
-                
-            # 2. Check Split Rules
-            match_log = []
-            
-            # Tag Rule
-            tag_rule = None
-            for r in rules_list:
-                if r['type'] == 'tag':
-                    rule_match = r['match'].lower().replace('#', '').strip()
-                    is_match = rule_match in tags
-                    match_log.append(f"TagRule '{rule_match}' in {tags}? {is_match}")
-                    if is_match:
-                        tag_rule = r
-                        break
-            
-            # Category Rule
-            cat_rule = None
-            if not tag_rule:
-                for r in rules_list:
-                    if r['type'] == 'category':
-                        rule_match = r['match']
-                        is_match = rule_match == category
-                        match_log.append(f"CatRule '{rule_match}' vs '{category}'? {is_match}")
-                        if is_match:
-                            cat_rule = r
-                            break
-            
-            active_rule = tag_rule if tag_rule else cat_rule
-            
-            if active_rule:
-                my_share = active_rule['my_share'] / 100.0
-                partner_share = 1.0 - my_share
-                
-                if partner_share > 0:
-                    owed_amount = amount * partner_share
-                    total_partner_owes += owed_amount
-                    
-                    # Store enriched row
-                    row_data = row.to_dict()
-                    row_data['owed'] = owed_amount
-                    row_data['share_desc'] = f"{int(partner_share*100)}% ({active_rule['match']})"
-                    split_transactions.append(row_data)
-            
-            else:
-                # Default
-                defaults = ['split', 'condiviso', 'shared', 'comune']
-                is_default_split = any(k in tags for k in defaults)
-                match_log.append(f"Defaults {defaults} in {tags}? {is_default_split}")
-                
-                if is_default_split:
-                     partner_share = 1.0 - default_pct
-                     owed_amount = amount * partner_share
-                     total_partner_owes += owed_amount
-                     
-                     row_data = row.to_dict()
-                     row_data['owed'] = owed_amount
-                     row_data['share_desc'] = f"{int(partner_share*100)}% (Default)"
-                     split_transactions.append(row_data)
-
-            # Update debug info in DF using index
-            df_m.at[idx, 'debug_tags_clean'] = str(tags)
-            df_m.at[idx, 'debug_log'] =  "[" + "; ".join(parse_log) + "] " + " | ".join(match_log)
-
+        # Normalizzazione dei tag e scelta della regola per riga girano in DuckDB
+        total_partner_owes = float(df_m['owed'].sum())
+        s_df = df_m[df_m['bucket'].isin(['rule', 'default'])].reset_index(drop=True)
+        l_df = df_m[df_m['bucket'] == 'loan']
 
         # --- RESULTS ---
         st.divider()
@@ -284,73 +209,51 @@ def render_split(data_manager: DataManager):
         tab_det, tab_debug = st.tabs(["View Data", "Debug Inspector"])
         
         with tab_det:
-            if split_transactions:
+            if not s_df.empty:
                 st.write("### Shared Expenses")
-                s_df = pd.DataFrame(split_transactions)
                 st.dataframe(s_df[['date', 'description', 'category', 'amount', 'owed', 'share_desc']], use_container_width=True)
                 
-            if loan_transactions:
+            if not l_df.empty:
                 st.write("### Direct Loans (100%)")
-                # Handle if loan_transactions is list of Series or Dicts. 
-                # If Series, pd.DataFrame works. If Mixed, careful.
-                # Currently loan_transactions appends 'row' which is Series.
-                l_df = pd.DataFrame(loan_transactions)
                 st.dataframe(l_df[['date', 'description', 'tags', 'amount']], use_container_width=True)
                 
         with tab_debug:
             st.warning("Use this to check why a transaction is (or isn't) being split.")
-            debug_cols = ['date', 'description', 'category', 'amount', 'debug_tags_clean', 'debug_log']
-            st.dataframe(df_m[debug_cols], use_container_width=True)
+            # Costruito solo su richiesta: tag normalizzati e motivo della decisione per ogni riga
+            if st.checkbox("Enable debug inspector", value=False, key='split_debug'):
+                df_m['debug_tags_clean'] = df_m['tags_clean_txt']
+                rule_txt = ("Rule " + df_m['rule_kind'].fillna('') + " '" + df_m['rule_match'].fillna('')
+                            + "' → my share " + (df_m['my_share'] * 100).round().fillna(0).astype(int).astype(str) + "%")
+                df_m['debug_log'] = np.select(
+                    [df_m['bucket'].eq('loan').to_numpy(dtype=bool),
+                     df_m['rule_kind'].notna().to_numpy(dtype=bool),
+                     df_m['bucket'].eq('default').to_numpy(dtype=bool)],
+                    ["Identified as LOAN", rule_txt.to_numpy(dtype=object), "Default split tag"],
+                    default="No rule and no default split tag",
+                )
+                debug_cols = ['date', 'description', 'category', 'amount', 'debug_tags_clean', 'debug_log']
+                st.dataframe(df_m[debug_cols], use_container_width=True)
+            else:
+                st.caption("Enable the inspector to see the normalized tags and the rule applied to each expense.")
             
         # Generatore Messaggio
         st.subheader("📲 WhatsApp Export")
         
-        msg_lines = [f"📊 *Riassunto Spese {sel_month}/{sel_year}*"]
-        msg_lines.append(f"Totale da dare: *€{total_partner_owes:,.2f}*")
-        msg_lines.append("")
-        
-        if split_transactions:
-            msg_lines.append("🔸 *Spese Condivise:*")
-            
-            # Convert to DF for grouping
-            s_df = pd.DataFrame(split_transactions)
-            
-            # Ensure group_key exists (we added it in the loop logic below? No, wait, I need to add it to the loop first!)
-            # Let's aggregate by 'share_desc' which effectively captures the Rule+Percentage
-            # Or better, let's group by the Rule Name/Match.
-            # I will modify the loop above to add a 'rule_name' field.
-            # But since I can't touch the loop in this replacement chunk which is at the bottom, strictly speaking...
-            # I can rely on 'category' for category rules, but tag rules are tricky.
-            # actually, 'share_desc' contains "50% (Rule: gas)". I can extract "gas".
-            # But it's cleaner to just group by 'share_desc' to keep same-rule items together.
-            
-            # Let's try to group by the visible description used in the table
-            # share_desc format: "{pct}% (Rule: {match})" or "{pct}% (Default)"
-            
-            grouped = s_df.groupby('share_desc')[['amount', 'owed']].sum().reset_index()
-            
-            for _, grp in grouped.iterrows():
-                # Clean up label
-                label = grp['share_desc']
-                # Try to make it nicer: "50% (Rule: gas)" -> "Gas (50%)"
-                if "(Rule:" in label:
-                    # extract match
-                    match_part = label.split("Rule:")[1].replace(")", "").strip().capitalize()
-                    pct_part = label.split("%")[0] + "%"
-                    display_label = f"{match_part} ({pct_part})"
-                elif "Default" in label:
-                     display_label = "Varie/Generiche (Default)"
-                else:
-                    display_label = label
-                
-                msg_lines.append(f"- *{display_label}*: Tot. €{grp['amount']:.2f} ➡ *€{grp['owed']:.2f}*")
-            
-            msg_lines.append("")
-            
-        if loan_transactions:
-             msg_lines.append("🔹 *Prestiti/Anticipi (100%):*")
-             for t in loan_transactions:
-                 d_str = t['date'].strftime('%d/%m') if hasattr(t['date'], 'strftime') else str(t['date'])[:10]
-                 msg_lines.append(f"- {d_str} {t['description']}: €{abs(t['amount']):.2f}")
-                 
-        st.text_area("Copia questo messaggio", "\n".join(msg_lines), height=300)
+        def _msg_lines():
+            yield f"📊 *Riassunto Spese {sel_month}/{sel_year}*"
+            yield f"Totale da dare: *€{total_partner_owes:,.2f}*"
+            yield ""
+            if not s_df.empty:
+                yield "🔸 *Spese Condivise:*"
+                # Un totale per regola+percentuale, nell'ordine in cui compaiono nel mese
+                grouped = s_df.groupby(['rule_name', 'partner_pct'], sort=False, as_index=False)[['amount', 'owed']].sum()
+                for n, p, a, o in grouped.itertuples(index=False):
+                    label = "Varie/Generiche (Default)" if n == 'Default' else f"{str(n).capitalize()} ({p:.0f}%)"
+                    yield f"- *{label}*: Tot. €{a:.2f} ➡ *€{o:.2f}*"
+                yield ""
+            if not l_df.empty:
+                yield "🔹 *Prestiti/Anticipi (100%):*"
+                for d_str, desc, amt in zip(l_df['date'].dt.strftime('%d/%m'), l_df['description'], l_df['amount']):
+                    yield f"- {d_str} {desc}: €{abs(amt):.2f}"
+
+        st.text_area("Copia questo messaggio", "\n".join(_msg_lines()), height=300)
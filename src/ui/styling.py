@@ -1,8 +1,7 @@
+import re
 import streamlit as st
 
-def apply_custom_styles():
-    st.markdown("""
-        <style>
+_CSS_RAW = """
         /* Metrics styling */
         [data-testid="stMetricValue"] {
             font-size: 2rem;
@@ -26,9 +25,18 @@ def apply_custom_styles():
         .block-container {
             padding-top: 2rem;
         }
-        </style>
-    """, unsafe_allow_html=True)
+"""
+
+# CSS compattato una volta all'import (senza commenti e spazi superflui)
+_CSS_MIN = re.sub(r'\s+', ' ', re.sub(r'/\*.*?\*/', '', _CSS_RAW, flags=re.S)).strip()
+_STYLE_HTML = f"<style>{_CSS_MIN}</style>"
+
+# A professional, soft palette
+_CHART_COLORS = ("#636EFA", "#EF553B", "#00CC96", "#AB63FA", "#FFA15A", "#19D3F3", "#FF6692", "#B6E880")
+
+def apply_custom_styles():
+    # Va emesso a ogni rerun: Streamlit rimuove gli elementi non ridisegnati
+    st.markdown(_STYLE_HTML, unsafe_allow_html=True)
 
 def get_chart_colors():
-    # A professional, soft palette
-    return ["#636EFA", "#EF553B", "#00CC96", "#AB63FA", "#FFA15A", "#19D3F3", "#FF6692", "#B6E880"]
+    return _CHART_COLORS
@@ -2,6 +2,23 @@ import streamlit as st
 import pandas as pd
 from src.data_manager import DataManager
 
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _tag_stats(_dm, db_path, data_version):
+    """(tabella Tag/Count, lista ordinata dei tag): ricalcolate solo quando il DB cambia."""
+    # Conteggio aggregato in DuckDB: in pandas arriva una riga per tag, non per occorrenza
+    tag_counts = _dm.con.execute("""
+        SELECT tag AS Tag, COUNT(*) AS Count
+        FROM (SELECT unnest(tags) AS tag FROM transactions)
+        WHERE tag IS NOT NULL
+        GROUP BY tag
+        ORDER BY Count DESC, Tag
+    """).df()
+    if tag_counts.empty:
+        return None, []
+    return tag_counts, sorted(tag_counts['Tag'].tolist())
+
+
 def render_tag_manager(data_manager: DataManager):
     st.header("🏷️ Tag Manager")
     
@@ -9,18 +26,10 @@ def render_tag_manager(data_manager: DataManager):
     
     # Get all tags and stats
     try:
-        # We need counts.
-        # Efficient way: Get all tags unnested and count
-        df = data_manager.con.execute("SELECT unnest(tags) as tag FROM transactions").df()
-        if df.empty:
+        tag_counts, all_tags = _tag_stats(data_manager, data_manager.db_path, data_manager.data_version)
+        if tag_counts is None:
             st.warning("No tags found.")
             return
-            
-        tag_counts = df['tag'].value_counts().reset_index()
-        tag_counts.columns = ['Tag', 'Count']
-        tag_counts = tag_counts.sort_values('Count', ascending=False)
-        
-        all_tags = sorted(tag_counts['Tag'].unique().tolist())
         
     except Exception as e:
         st.error(f"Error loading tags: {e}")
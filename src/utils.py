@@ -13,34 +13,39 @@ SUBSCRIPTION_TAGS = {
 }
 
 
+# Virgola decimale -> punto (tabella per str.translate, costruita una volta)
+_COMMA_DOT = str.maketrans(',', '.')
+
+
 def clean_currency(amount_str):
     """Ensures amount is a float."""
     if isinstance(amount_str, (float, int)):
         return float(amount_str)
     try:
-        return float(str(amount_str).replace(',', '.'))
-    except:
+        return float(amount_str.translate(_COMMA_DOT) if isinstance(amount_str, str) else amount_str)
+    except (ValueError, TypeError):
         return 0.0
 
+# Tabella per str.translate: toglie i '#' in un solo passaggio
+_DROP_HASH = str.maketrans('', '', '#')
+
+# Hashtag nel testo libero (compilata una volta)
+_TAG_RE = re.compile(r"#(\w+)")
+
+
+def clean_tag(t):
+    """Tag normalizzato per i confronti: minuscolo, senza '#' e spazi ai bordi (come tags_clean in SQL)."""
+    return str(t).translate(_DROP_HASH).lower().strip()
+
 def extract_tags(text):
     """Extracts hashtags from a string."""
-    if not isinstance(text, str):
-        return []
-    return re.findall(r"#(\w+)", text)
+    return _TAG_RE.findall(text) if isinstance(text, str) else []
 
 def normalize_tags(tags_list):
     """Cleans and deduplicates a list of tags."""
     if not tags_list:
         return []
-    # Split comma separated strings if any
-    final_tags = []
-    for t in tags_list:
-        if isinstance(t, str):
-            # Remove # if present for storage, or keep it? 
-            # User seems to like #, let's keep them normalized as strings without # internally for cleaner matching, 
-            # or keep # for display. Let's strip # for processing and add back for display if needed.
-            # Actually user input "anche i campi con # eh" implies the input has #.
-            # Let's standardize: lowercase, no #, unique.
-            parts = t.replace('#', '').replace(',', ' ').split()
-            final_tags.extend([p.lower() for p in parts])
-    return sorted(list(set(final_tags)))
+    # Standard: minuscolo, senza '#', unici; le stringhe con virgole/spazi
+    # ("#tag1, #tag2") diventano più tag. Un solo set, un solo sort.
+    return sorted({p.lower() for t in tags_list if isinstance(t, str)
+                   for p in t.replace('#', '').replace(',', ' ').split()})
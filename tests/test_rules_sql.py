@@ -0,0 +1,61 @@
+import unittest
+
+import pandas as pd
+
+from src.data_manager import DataManager, _tag_key
+
+
+class RulesSqlParityTest(unittest.TestCase):
+    """_rules_sql (DuckDB) deve dare gli stessi delta del percorso pandas."""
+
+    def setUp(self):
+        self.dm = DataManager(db_path=':memory:')
+        self.dm.rules_engine.rules = {
+            'categories': [{'name': 'Casa', 'match': ['affitto'], 'necessity': 'Need'}],
+            'tags': [{'tag': 'utenze', 'match': ['enel']}],
+            'tag_necessity': {'gas': 'Need', 'utenze': 'Need'},
+        }
+        rows = [
+            ('a', 'Bolletta GAS marzo', []),
+            ('b', 'Enel energia', []),
+            ('c', 'Enel gas e luce', []),
+            ('d', 'Affitto gennaio', ['gas']),
+            ('e', 'Cena fuori', []),
+        ]
+        for tx_id, desc, tags in rows:
+            self.dm.con.execute(
+                "INSERT INTO transactions (id, date, amount, description, type, tags, necessity) "
+                "VALUES (?, DATE '2024-01-10', -10.0, ?, 'Expense', ?::VARCHAR[], 'Want')",
+                [tx_id, desc, tags])
+
+    @staticmethod
+    def _state(r):
+        # NaN/None del DataFrame -> None, tag come tupla
+        return (None if pd.isna(r.category) else r.category, r.necessity, _tag_key(r.tags))
+
+    def tearDown(self):
+        self.dm.con.close()
+
+    def _sql_result(self):
+        df = self.dm.con.execute(self.dm._rules_sql()).df()
+        return {r.id: self._state(r) for r in df.itertuples()}
+
+    def _pandas_result(self):
+        df = self.dm.get_transactions()
+        before = {r.id: self._state(r) for r in df.itertuples()}
+        df = self.dm.rules_engine.apply_rules(df)
+        df = self.dm.rules_engine.auto_tag_from_description(df)
+        after = {r.id: self._state(r) for r in df.itertuples()}
+        return {i: v for i, v in after.items() if v != before[i]}
+
+    def test_keyword_tags_do_not_drive_tag_necessity(self):
+        sql = self._sql_result()
+        self.assertEqual(sql['a'][1], 'Want')
+        self.assertEqual(sql['a'][2], ('gas',))
+
+    def test_sql_matches_pandas(self):
+        self.assertEqual(self._sql_result(), self._pandas_result())
+
+
+if __name__ == '__main__':
+    unittest.main()